@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the parser pipeline.
+
+usage:
+    python benchmarks.py                  # on a generated export
+    python benchmarks.py path/to/file.tsv # on a real Tobii export
+    python benchmarks.py --imports        # startup time of main_data_parser
+
+    python benchmarks.py --suite --save results.json                  # hot paths on synthetic sessions
+    python benchmarks.py --suite --quick --compare baseline.json      # fails on slowdowns against a baseline
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+import numpy as np
+import pandas as pd
+
+import constants as c
+import reading_and_transformations as rt
+from constants import ST
+
+
+def write_sample_export(path, n_rows=300000, track_loss=0.15, seed=0):
+    """
+    Writes a Tobii-like export: 60 Hz timestamps, (-1,-1) for lost samples,
+    some event rows and the extra columns Tobii Studio exports.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    timestamps = np.round(np.arange(n_rows) * ST, 1)
+    x = rng.integers(0, 1920, n_rows).astype(float)
+    y = rng.integers(0, 1200, n_rows).astype(float)
+    lost = rng.random(n_rows) < track_loss
+    x[lost], y[lost] = -1, -1
+
+    event = np.full(n_rows, "", dtype=object)
+    event_rows = np.arange(0, n_rows, 600)
+    event[event_rows] = "intro_with_face_start"
+    x[event_rows], y[event_rows] = np.nan, np.nan
+
+    df = pd.DataFrame({"TimeStamp": timestamps,
+                       "Event": event,
+                       "GazePointX": x,
+                       "GazePointY": y,
+                       "ValidityLeft": np.where(lost, 4, 0),
+                       "ValidityRight": np.where(lost, 4, 0),
+                       "PupilLeft": rng.normal(3.5, 0.2, n_rows).round(2),
+                       "PupilRight": rng.normal(3.5, 0.2, n_rows).round(2)})
+    df.to_csv(path, sep="\t", index=False)
+
+
+def bench_read_tsv_file(logfilepath, engines=("python", "c"), repeat=3):
+    """
+    Times read_tsv_file with each engine, checks that the frames are the same
+    (or that every engine rejects the file: None).
+    Returns a dict of {engine: best time in seconds}.
+    """
+
+    results = {}
+    frames = {}
+    for engine in engines:
+        frames[engine] = rt.read_tsv_file(logfilepath, engine=engine)
+        results[engine] = min(timeit.repeat(lambda: rt.read_tsv_file(logfilepath, engine=engine),
+                                            number=1, repeat=repeat))
+
+    reference = frames[engines[0]]
+    for engine in engines[1:]:
+        if reference is None or frames[engine] is None:
+            if reference is not None or frames[engine] is not None:
+                rejected = engines[0] if reference is None else engine
+                raise AssertionError(f"{logfilepath} is only rejected by engine={rejected}")
+        else:
+            pd.testing.assert_frame_equal(reference, frames[engine])
+
+    return results
+
+
+# modules only the later stages (aggregation, time course, plotting, statistics) may import
+LAZY_MODULES = ("swifter", "dask", "tqdm", "plotly", "scipy")
+
+
+def bench_import_time(module="main_data_parser", repeat=5):
+    """
+    Measures the import of module in a fresh interpreter with python -X importtime.
+    Returns:
+        best cumulative import time of the module in seconds
+        list of the LAZY_MODULES that got imported (should be empty)
+    """
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              cwd=here, capture_output=True, text=True, check=True)
+        # import time: self [us] | cumulative | imported package
+        for line in proc.stderr.splitlines():
+            match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$", line)
+            if match and match.group(2) == module:
+                times.append(int(match.group(1)) / 1e6)
+        loaded = [m for m in proc.stdout.strip().split(",") if m]
+
+    return min(times), loaded
+
+
+def check_import_time(module="main_data_parser", budget=None):
+    """
+    Guard against startup regressions: fails if a lazy module is imported eagerly,
+    or if the import takes longer than budget seconds.
+    """
+
+    t, loaded = bench_import_time(module)
+    print(f"import {module}: {t:.3f} s")
+
+    if loaded:
+        raise AssertionError(f"import {module} eagerly imports {', '.join(loaded)}")
+    if budget is not None and t > budget:
+        raise AssertionError(f"import {module} took {t:.3f} s (budget {budget:.3f} s)")
+
+
+def main(logfilepath=None):
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if logfilepath is None:
+            logfilepath = os.path.join(tmp, "sample_export.tsv")
+            write_sample_export(logfilepath)
+
+        results = bench_read_tsv_file(logfilepath)
+        if rt.read_tsv_file(logfilepath) is None:
+            print(f"{logfilepath} has an invalid format, the times are of rejecting it")
+
+    for engine, t in results.items():
+        print(f"read_tsv_file engine={engine}: {t:.3f} s")
+    if "python" in results:
+        for engine, t in results.items():
+            if engine != "python":
+                print(f"speedup {engine}: {results['python'] / t:.1f}x")
+
+
+### Suite ###
+# session lengths (s, None: length of the experiment, ~2.5 min) and cohort sizes of the suite
+SESSION_SECONDS = (None, 900, 3600)
+COHORT_SIZES = (12, 48)
+QUICK_SESSION_SECONDS = (None, 600)
+QUICK_COHORT_SIZES = (6,)
+
+
+def run_suite(session_seconds=SESSION_SECONDS, cohort_sizes=COHORT_SIZES, repeat=3):
+    """
+    Times the hot paths on synthetic sessions (see synthetic_sessions):
+        per session length: read_tsv_file, interpolate_missing_samples, assign_aoi_tags,
+                            collect_gaze, _calculate_onscreen_look
+        per cohort size: main (run_pipeline with the default settings), aggregate_data,
+                         _do_target_look_calculations, cluster_test (10000 permutations, Novel - Familiar paired),
+                         bootstrap_bands (2000 resamples, Familiar)
+    Returns {"benchmark[size]": {"best", "mean", "repeat", "number"}}, times in seconds per call.
+    """
+
+    import bootstrap_bands
+    import cluster_permutation as cluster
+    import main_data_parser as mdp
+    import synthetic_sessions
+    from session import Session
+
+    results = {}
+
+    def bench(name, func, n=repeat):
+        # fast functions are called number times per repeat (at least 0.2 s), the times are per call
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        times = [t / number for t in timer.repeat(repeat=n, number=number)]
+        results[name] = dict(best=min(times), mean=sum(times) / len(times), repeat=n, number=number)
+        print(f"{name:45} {min(times):9.4f} s", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as tmp, _quiet():
+
+        for seconds in session_seconds:
+            size = f"{seconds}s" if seconds else "experiment"
+            path = os.path.join(tmp, f"session_{size}.tsv")
+            synthetic_sessions.write_session(path, duration=seconds, seed=0)
+
+            bench(f"read_tsv_file[{size}]", lambda: rt.read_tsv_file(path))
+
+            df_events, df = rt.detach_events(rt.read_tsv_file(path))
+            bench(f"interpolate_missing_samples[{size}]", lambda: rt.interpolate_missing_samples(df))
+
+            df = rt.interpolate_missing_samples(df)
+            test = c.Test_controll_data(df_events, oldlog=False)
+            side = test.interesting_sides[0]
+            aoi = mdp.AOI(*c.AOI_dict[side])
+            bench(f"assign_aoi_tags[{size}]", lambda: rt.assign_aoi_tags(df, aoi))
+
+            tagged = rt.assign_aoi_tags(df, aoi)
+            bench(f"collect_gaze[{size}]", lambda: mdp.calc.collect_gaze(tagged))
+
+            fam, teaching = c.Fam_data(df_events), c.Teaching_data(df_events, oldlog=False)
+            starts = fam.start_times + teaching.start_times + test.bl_start_times + test.start_times
+            ends = fam.end_times + teaching.end_times + test.ag_start_times + test.end_times
+            bench(f"_calculate_onscreen_look[{size}]", lambda: mdp._calculate_onscreen_look(Session(df), starts, ends))
+
+        for subjects in cohort_sizes:
+            size = f"{subjects}subj"
+            base_dir = os.path.join(tmp, size)
+            logfilespath = os.path.join(base_dir, "data_to_read")
+            synthetic_sessions.write_cohort(logfilespath, subjects=subjects, seed=0)
+
+            def config(**kwargs):
+                return mdp.RunConfig(base_dir=base_dir, logfilespath=logfilespath, use_cache=False, **kwargs)
+
+            bench(f"main[{size}]", lambda: mdp.run_pipeline(config()))
+
+            ord_dict, tc_dict = mdp.run_pipeline(config(do_aggregation=False, save_to_file=False,
+                                                        save_tc=False))
+            cfg = config()
+            bench(f"aggregate_data[{size}]", lambda: _aggregate(ord_dict, cfg))
+
+            with _no_plot_windows():
+                bench(f"_do_target_look_calculations[{size}]", lambda: _target_looks(tc_dict, cfg))
+
+            familiar, differences = _target_look_matrices(tc_dict)
+            bench(f"cluster_test[{size}]", lambda: cluster.cluster_test(differences, workers=cfg.workers))
+            bench(f"bootstrap_bands[{size}]", lambda: bootstrap_bands.bootstrap_bands(familiar, workers=cfg.workers))
+
+    return results
+
+
+def _aggregate(ord_dict, config):
+
+    import looking_time_aggregations as aggr
+    os.makedirs(config.dir_name, exist_ok=True)
+    aggr.aggregate_data(ord_dict, config.timing, dir_name=config.dir_name, date=config.date)
+
+
+def _target_looks(tc_dict, config):
+
+    import time_course_plotting as time_course
+    os.makedirs(config.plots_dir, exist_ok=True)
+    os.makedirs(config.tc_tables_dir, exist_ok=True)
+    time_course._do_target_look_calculations(tc_dict, fam=False, plots_dir=config.plots_dir,
+                                             tables_dir=config.tc_tables_dir)
+
+
+def _target_look_matrices(tc_dict):
+    """ Familiar target look matrix and the paired Novel - Familiar differences. """
+
+    import time_course_plotting as time_course
+    tls_per_trials = time_course._target_looks_per_trials(tc_dict, fam=False)
+    familiar, novel = (time_course._target_look_matrix(list(tls_per_trials[nr].values())) for nr in [0, 1])
+    return familiar, time_course._paired_differences(familiar, novel, list(tls_per_trials[0]), list(tls_per_trials[1]))
+
+
+@contextlib.contextmanager
+def _quiet():
+    """ Silences the prints of the pipeline (the timings go to stderr). """
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+@contextlib.contextmanager
+def _no_plot_windows():
+    """ The plots are written to html but not opened while timing. """
+
+    import plotly.graph_objects as go
+    show = go.Figure.show
+    go.Figure.show = lambda self, *args, **kwargs: None
+    try:
+        yield
+    finally:
+        go.Figure.show = show
+
+
+def environment():
+    """ Versions and machine of a run, stored with the results. """
+
+    versions = {}
+    for module in ("numpy", "pandas", "swifter", "plotly", "xlsxwriter", "openpyxl"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return dict(date=datetime.datetime.now().isoformat(timespec="seconds"), commit=commit,
+                python=platform.python_version(), machine=platform.platform(), cpus=os.cpu_count(),
+                versions=versions)
+
+
+def save_results(path, results):
+
+    with open(path, "w") as f:
+        json.dump(dict(environment=environment(), results=results), f, indent=1)
+
+
+def load_results(path):
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(results, baseline, tolerance=0.2):
+    """
+    Prints the best times against the baseline (a saved results file).
+    Returns the benchmarks that got slower by more than tolerance (proportion).
+    """
+
+    base = baseline["results"]
+    env = baseline.get("environment", {})
+    print(f"baseline: {env.get('date')} commit {env.get('commit')} {env.get('versions')}")
+    print(f"{'benchmark':45} {'baseline':>10} {'now':>10} {'ratio':>7}")
+
+    slower = []
+    for name, r in results.items():
+        if name not in base:
+            print(f"{name:45} {'-':>10} {r['best']:10.4f}")
+            continue
+        ratio = r["best"] / base[name]["best"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            slower.append(name)
+            flag = "  SLOWER"
+        elif ratio < 1 / (1 + tolerance):
+            flag = "  faster"
+        print(f"{name:45} {base[name]['best']:10.4f} {r['best']:10.4f} {ratio:7.2f}{flag}")
+
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the parser pipeline.")
+    parser.add_argument("logfilepath", nargs="?", help="Tobii export to read, default: generated export")
+    parser.add_argument("--imports", action="store_true", help="measure the startup time of main_data_parser")
+    parser.add_argument("--import-budget", type=float, help="maximum import time in seconds")
+    parser.add_argument("--suite", action="store_true", help="run the benchmark suite on synthetic sessions")
+    parser.add_argument("--quick", action="store_true", help="smaller sessions and cohorts")
+    parser.add_argument("--save", help="json file to store the suite results")
+    parser.add_argument("--compare", help="json file of baseline results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+
+    if args.imports:
+        check_import_time(budget=args.import_budget)
+    elif args.suite:
+        if args.quick:
+            results = run_suite(QUICK_SESSION_SECONDS, QUICK_COHORT_SIZES)
+        else:
+            results = run_suite()
+        if args.save:
+            save_results(args.save, results)
+        if args.compare:
+            slower = compare_results(results, load_results(args.compare), tolerance=args.tolerance)
+            if slower:
+                sys.exit(f"slower than the baseline: {', '.join(slower)}")
+    else:
+        main(args.logfilepath)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Bootstrap percentile confidence bands of the mean time course.
+
+input: target look matrix (subjects x samples, nan: no data), see time_course_plotting._target_look_matrix
+
+The subjects are resampled with replacement, the band at every sample is the percentile interval
+of the means of the resamples (the mean of the subjects with data at the sample, as sample_mean).
+The resamples are done in chunks as matrix products: a chunk x subjects matrix of how many times
+each subject is drawn, times the data, gives the sums of the whole chunk (see chunked_resampling).
+"""
+
+import functools
+import numpy as np
+
+from chunked_resampling import map_chunks
+
+
+N_RESAMPLES = 2000
+CHUNKSIZE = 500 # resamples per matrix product
+
+
+def bootstrap_bands(matrix, n_resamples=N_RESAMPLES, ci=0.95, workers=1, chunksize=CHUNKSIZE, seed=0):
+    """
+    matrix: subjects x samples array (nan: no data)
+    ci: confidence level of the bands
+    workers: nr of processes for the resamples
+    returns:
+        lower, upper: bounds of the band at every sample (nan with data of less than 2 subjects)
+    """
+
+    x = np.asarray(matrix, dtype=np.float64)
+    valid = ~np.isnan(x)
+    if len(x) < 2:
+        return np.full(x.shape[1], np.nan), np.full(x.shape[1], np.nan)
+
+    data = dict(x=np.where(valid, x, 0), valid=valid.astype(np.float64))
+
+    means = map_chunks(functools.partial(_resample_means, data), n_resamples, chunksize, seed=seed, workers=workers)
+    means = np.concatenate(means) if means else np.full((0, x.shape[1]), np.nan)
+
+    # the band of the samples with data of at least 2 subjects (the others would be all-nan slices)
+    alpha = (1 - ci) / 2
+    lower, upper = np.full(x.shape[1], np.nan), np.full(x.shape[1], np.nan)
+    enough = valid.sum(axis=0) >= 2
+    if enough.any():
+        lower[enough], upper[enough] = np.nanpercentile(means[:, enough], [100 * alpha, 100 * (1 - alpha)], axis=0)
+
+    return lower, upper
+
+
+def _resample_means(data, size, seed):
+    """ Means of size resamples of the subjects: size x samples (nan where no resampled subject has data). """
+
+    rng = np.random.default_rng(seed)
+    nr_subjects = len(data["x"])
+
+    # times each subject is drawn in each resample
+    draws = rng.integers(0, nr_subjects, size=(size, nr_subjects))
+    draws += nr_subjects * np.arange(size)[:, None]
+    weights = np.bincount(draws.ravel(), minlength=size * nr_subjects).reshape(size, nr_subjects).astype(np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ data["x"]) / (weights @ data["valid"])
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+Random resamples (permutations, bootstrap resamples) in chunks, as done by cluster_permutation and bootstrap_bands.
+
+The chunk size bounds the memory of a matrix product, the chunks can be spread over a process pool.
+Every chunk has its own seed (spawned from one SeedSequence), so the results do not depend on the nr of workers.
+"""
+
+import concurrent.futures
+import numpy as np
+
+
+def map_chunks(func, n, chunksize, seed=0, workers=1):
+    """
+    Calls func(size, seed) on the chunks of n resamples.
+    func: picklable (e.g. a module level function or a functools.partial of one) if workers > 1
+    workers: nr of processes for the chunks
+    returns:
+        list of the results of the chunks, in order
+    """
+
+    sizes = [min(chunksize, n - start) for start in range(0, n, chunksize)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers > 1 and len(sizes) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, sizes, seeds))
+    else:
+        return list(map(func, sizes, seeds))
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Cluster-based permutation test over time courses (Maris & Oostenveld 2007).
+
+input: target look matrices (subjects x samples, nan: no data), see time_course_plotting._target_look_matrix
+
+1. t-score of every sample:
+    one sample (a trial type against 0): t = mean / (sd / sqrt(n))
+    two independent samples (different subjects): t = (mean1 - mean2) / sqrt(var1/n1 + var2/n2) (Welch)
+   Paired data (e.g. Familiar and Novel trials of the same subjects) is tested as one sample:
+   the differences of the subjects against 0 (see time_course_plotting._paired_differences).
+   n: nr of subjects with data at the sample, samples with less than 2 are left out.
+2. clusters: runs of adjacent samples with t above the threshold (or below -threshold),
+   cluster mass = sum of the t-scores of the run.
+3. null distribution of the largest cluster mass:
+    one sample: the signs of the subjects are flipped at random
+    two samples: the subjects are shuffled between the two groups
+   The permutations are done in chunks as matrix products: with a chunk x subjects matrix of
+   signs (or group memberships) the sums of all permutations are one product with the data
+   (see chunked_resampling).
+4. p-value of an observed cluster: (1 + nr of permutations with a larger max mass) / (1 + nr of permutations)
+"""
+
+import functools
+import numpy as np
+import pandas as pd
+
+from chunked_resampling import map_chunks
+
+
+N_PERMUTATIONS = 10000
+CHUNKSIZE = 1000 # permutations per matrix product
+
+
+def cluster_test(a, b=None, n_permutations=N_PERMUTATIONS, threshold=None, alpha=0.05, tail=0,
+                 workers=1, chunksize=CHUNKSIZE, seed=0):
+    """
+    a, b: subjects x samples arrays (nan: no data); b None: a against 0
+        b is an independent group (different subjects than a); for paired data test the differences against 0
+    threshold: cluster forming t threshold, default: critical t of alpha (two-sided if tail == 0)
+        with the degrees of freedom of all subjects
+    tail: 0: positive and negative clusters, 1: only positive, -1: only negative
+    workers: nr of processes for the permutations
+    returns:
+        t_obs: t-score of every sample (nan where it can't be calculated)
+        clusters: DataFrame of the observed clusters: sign, start, end (sample indexes, end exclusive), mass, p_value
+    """
+
+    data = _prepare(a, b)
+
+    if threshold is None:
+        from scipy import stats
+        df = len(a) - 1 if b is None else len(a) + len(b) - 2
+        threshold = stats.t.ppf(1 - alpha / (2 if tail == 0 else 1), df)
+
+    t_obs = _t_scores(data, None)[0]
+    clusters = _clusters(t_obs, threshold, tail)
+
+    null_chunk = functools.partial(_null_max_masses, data, threshold=threshold, tail=tail)
+    null = map_chunks(null_chunk, n_permutations, chunksize, seed=seed, workers=workers)
+    null = np.concatenate(null) if null else np.zeros(0)
+
+    clusters["p_value"] = [(1 + np.sum(null >= abs(mass))) / (1 + len(null)) for mass in clusters["mass"]]
+
+    return t_obs, clusters
+
+
+def _prepare(a, b):
+    """
+    The data with nan as 0, the valid indicator and the squares (the sums of permutations are products with these).
+    nr_a: nr of subjects in the first group (None: one sample test)
+    """
+
+    if b is None:
+        x = np.asarray(a, dtype=np.float64)
+    else:
+        # time courses of different lengths: nan-padded to the longer
+        a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+        x = np.full((len(a) + len(b), max(a.shape[1], b.shape[1])), np.nan)
+        x[:len(a), :a.shape[1]], x[len(a):, :b.shape[1]] = a, b
+    valid = ~np.isnan(x)
+    x = np.where(valid, x, 0)
+
+    return dict(x=x, valid=valid.astype(np.float64), x2=x**2, nr_a=None if b is None else len(a))
+
+
+def _t_scores(data, perms):
+    """
+    t-scores of the permutations.
+    perms: permutations x subjects matrix: signs (one sample) or 1 for the first group (two samples);
+        None: the observed data
+    returns:
+        permutations x samples array
+    """
+
+    x, valid, x2, nr_a = data["x"], data["valid"], data["x2"], data["nr_a"]
+
+    if perms is None:
+        perms = np.ones((1, len(x))) if nr_a is None else (np.arange(len(x)) < nr_a)[None, :].astype(np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if nr_a is None:
+            # flipping signs changes the sums only
+            n, sum2 = valid.sum(axis=0), x2.sum(axis=0)
+            mean = perms @ x / n
+            var = (sum2 - n * mean**2) / (n - 1)
+            t = mean / np.sqrt(var / n)
+            t[:, n < 2] = np.nan
+
+        else:
+            n_a, sum_a, sum2_a = perms @ valid, perms @ x, perms @ x2
+            n_b, sum_b, sum2_b = valid.sum(axis=0) - n_a, x.sum(axis=0) - sum_a, x2.sum(axis=0) - sum2_a
+            mean_a, mean_b = sum_a / n_a, sum_b / n_b
+            var_a = (sum2_a - n_a * mean_a**2) / (n_a - 1)
+            var_b = (sum2_b - n_b * mean_b**2) / (n_b - 1)
+            t = (mean_a - mean_b) / np.sqrt(var_a / n_a + var_b / n_b)
+            t[(n_a < 2) | (n_b < 2)] = np.nan
+
+    t[~np.isfinite(t)] = np.nan
+
+    return t
+
+
+def _signs(tail):
+    return {0: (1, -1), 1: (1,), -1: (-1,)}[tail]
+
+
+def _max_cluster_masses(t, threshold, tail):
+    """ Largest cluster mass (absolute) in every row of t (permutations x samples). """
+
+    t = np.nan_to_num(t)
+    positions = np.arange(t.shape[1])
+
+    max_masses = np.zeros(len(t))
+    for sign in _signs(tail):
+        above = sign * t > threshold
+        cumsum = np.cumsum(np.where(above, sign * t, 0), axis=1)
+        # cumsum at the last sample before the cluster
+        last_out = np.maximum.accumulate(np.where(above, -1, positions), axis=1)
+        base = np.where(last_out >= 0, np.take_along_axis(cumsum, np.maximum(last_out, 0), axis=1), 0)
+        max_masses = np.maximum(max_masses, (cumsum - base).max(axis=1, initial=0))
+
+    return max_masses
+
+
+def _null_max_masses(data, size, seed, threshold, tail):
+    """ Largest cluster masses of size random permutations. """
+
+    rng = np.random.default_rng(seed)
+    nr_subjects = len(data["x"])
+
+    if data["nr_a"] is None:
+        perms = rng.choice(np.array([-1.0, 1.0]), size=(size, nr_subjects))
+    else:
+        groups = np.tile((np.arange(nr_subjects) < data["nr_a"]).astype(np.float64), (size, 1))
+        perms = rng.permuted(groups, axis=1)
+
+    return _max_cluster_masses(_t_scores(data, perms), threshold, tail)
+
+
+def _clusters(t, threshold, tail):
+    """ Clusters of the t-scores of one time course: DataFrame of sign, start, end, mass. """
+
+    t = np.nan_to_num(t)
+
+    clusters = []
+    for sign in _signs(tail):
+        above = np.concatenate(([False], sign * t > threshold, [False]))
+        edges = np.flatnonzero(np.diff(above.astype(np.int8)))
+        for start, end in zip(edges[::2], edges[1::2]):
+            clusters.append((sign, start, end, t[start:end].sum()))
+
+    return pd.DataFrame(clusters, columns=["sign", "start", "end", "mass"]).sort_values("start", ignore_index=True)
@@ -82,6 +82,9 @@ AOI_screen = [DIAG1,DIAG2]
 
 AOI_ag = [(960,600), 320,320] # x:760-1160, y:420-780
 
+# aoi tags; position in list = int8 code of the tag
+AOI_TAGS = ["OUT", "INT", "BOR", "ATT", "FAM"]
+
 fam_demo_dur = 6000
 anim_dur = 12533
 
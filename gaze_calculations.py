@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 
-from constants import ST # sample time
+import numpy as np
+import pandas as pd
+
+from constants import ST, AOI_TAGS # sample time, aoi tags
+import instrumentation as instr
 
 
 def collect_gaze(df,  collect_init_look=True, threshold=134):
@@ -25,9 +29,11 @@ def collect_gaze(df,  collect_init_look=True, threshold=134):
             -> fixation started outside of response latency period isn't a first look.
     --------------
     variables:
-        gaze_list: list of lists of successive gazepoints ('hits') within the same aoi,
-            where len(hits) >= min_sample_nr
-        tag_time_dur_dict: dictionary of the form {rank:[tag, (starting) time, duration (lenght)]}
+        runs: successive gazepoints ('hits') within the same aoi, found by run-length encoding the tags
+            a run is a gaze if (same thresholds as the original sample-by-sample collection):
+                - followed by another object tag: nr of hits >= min_sample_nr-1
+                - followed by "OUT": nr of hits >= min_sample_nr
+                - at the end of df: nr of hits >= min_sample_nr (and at least 2)
     --------------
     Returns
         a GazeCollection object
@@ -35,67 +41,96 @@ def collect_gaze(df,  collect_init_look=True, threshold=134):
 
     min_sample_nr = int(threshold / ST) # 8 samples at 134 threshold
 
-    gaze_list = [] # list of hit lists
+    with instr.stage("gaze_collection", samples=len(df)):
+        tag_codes, times, durations = _segment_gaze(df["aoi"], df["TimeStamp"].to_numpy(), min_sample_nr)
 
-    hits = [] # first element is timestamp of gaze start, rest are look tags.
-    for i in df.index:
+        gaze_coll = GazeCollection.from_arrays(tag_codes, times, durations)
 
-        look = df.at[i, "aoi"]
+    return gaze_coll
 
-        if look != "OUT":
 
-            if not hits: # empty hits list
-                latency = df.at[i, "TimeStamp"] #- start
-                hits.append(latency)
-                hits.append(look)
+def _segment_gaze(aoi, timestamps, min_sample_nr):
+    """
+    Finds the gazes in a series of aoi tags.
+    Returns the tags (AOI_TAGS codes), starting times and durations (nr of samples) of the gazes.
+    """
 
-            elif look in hits:
-                hits.append(look)
-                # if last row:
-                if (i == df.index[-1]) and (len(hits) > min_sample_nr): # time is also in the hits
-                    gaze_list.append(hits[:])
+    codes, tags = _aoi_codes(aoi)
+    out_code = tags.index("OUT") if "OUT" in tags else -2
 
-            else: # new aoi tag
-                if len(hits) >= min_sample_nr:
-                    gaze_list.append(hits[:])
+    n = len(codes)
+    if n == 0:
+        return np.empty(0, dtype=np.int8), np.empty(0), np.empty(0, dtype=np.int32)
 
-                hits[:] = []
-                latency = df.at[i, "TimeStamp"] #- start
-                hits.append(latency)
-                hits.append(look)
+    # run-length encoding
+    starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    ends = np.append(starts[1:], n)
+    lengths = ends - starts
+    run_codes = codes[starts]
+    next_codes = np.append(run_codes[1:], out_code)
 
-        else:
-            if len(hits) > min_sample_nr:
-                gaze_list.append(hits[:])
-            hits[:] = []
+    is_last = ends == n
+    long_enough = np.where(next_codes == out_code, lengths >= min_sample_nr, lengths >= min_sample_nr-1)
+    long_enough[is_last] = (lengths[is_last] >= min_sample_nr) & (lengths[is_last] >= 2)
 
-    # -> tag_time_dur_dict: {rank:[tag, time, duration (lenght)]}
-    tag_time_dur_dict = {i+1:[gaze[-1], gaze[0], len(gaze[1:])] for i,gaze in enumerate(gaze_list)}
+    gazes = (run_codes != out_code) & long_enough
 
-    gaze_coll = GazeCollection(tag_time_dur_dict)
+    tag_codes = np.array([AOI_TAGS.index(tag) for tag in tags], dtype=np.int8)
+
+    return tag_codes[run_codes[gazes]], timestamps[starts[gazes]], lengths[gazes]
 
-    return gaze_coll
+
+def _aoi_codes(aoi):
+    """ Returns integer codes and the list of tags of an aoi tag series. """
+
+    if isinstance(aoi.dtype, pd.CategoricalDtype):
+        return aoi.cat.codes.to_numpy(), list(aoi.cat.categories)
+
+    codes, tags = pd.factorize(aoi)
+    return codes, list(tags)
 
 
 class GazeCollection:
     """
-    Creates an object with a dictionary as instance variable.
+    Creates an object holding the gazes in a structured array (one record per gaze, in rank order):
+        tag: AOI_TAGS code, time: (starting) time, duration: duration (lenght)
+    The gaze of rank r is record r-1.
 
     tag_time_dur_dict: {rank:[tag, (starting) time, duration (lenght)]}
     """
 
+    __slots__ = ("_gazes",)
+
+    dtype = np.dtype([("tag", np.int8), ("time", np.float64), ("duration", np.int32)])
+
+
     def __init__(self, tag_time_dur_dict):
-        self._dict = tag_time_dur_dict
+
+        gazes = [tag_time_dur_dict[rank] for rank in sorted(tag_time_dur_dict.keys())]
+        self._gazes = np.array([(AOI_TAGS.index(tag), time, dur) for tag, time, dur in gazes], dtype=self.dtype)
+
+
+    @classmethod
+    def from_arrays(cls, tag_codes, times, durations):
+        """ Creates the object from arrays of AOI_TAGS codes, starting times and durations. """
+
+        gaze_coll = cls.__new__(cls)
+        gaze_coll._gazes = np.empty(len(tag_codes), dtype=cls.dtype)
+        gaze_coll._gazes["tag"] = tag_codes
+        gaze_coll._gazes["time"] = times
+        gaze_coll._gazes["duration"] = durations
+
+        return gaze_coll
+
+
+    def __len__(self):
+        return len(self._gazes)
 
 
     def get_taglist(self):
         """ Returns the tags in the gaze object """
 
-        taglist = []
-        for v in self._dict.values():
-            taglist.append(v[0])
-
-        return taglist
+        return [AOI_TAGS[code] for code in self._gazes["tag"]]
 
 
     def get_last_gaze(self):
@@ -106,26 +141,24 @@ class GazeCollection:
 
         """
 
-        gaze_nr = list(self._dict.keys())[-1]
-        gaze_data = self._dict[gaze_nr]
-        latency = gaze_data[1]
+        tag, latency, duration = self._gazes[-1]
 
-        return gaze_data[0], latency, gaze_data[2]
+        return AOI_TAGS[tag], float(latency), int(duration)
 
 
     def get_gaze_data(self, gaze_nr, start_time=0):
         """ Returns the tag, time, duration for a given rank key"""
 
-        if gaze_nr not in self._dict.keys():
+        if not 1 <= gaze_nr <= len(self._gazes):
             return None, None, None
 
         else:
-            gaze_data = self._dict[gaze_nr]
-            latency = gaze_data[1] - start_time
+            tag, time, duration = self._gazes[gaze_nr-1]
+            latency = float(time) - start_time
             if latency > 2000:
                 return None, None, None
             else:
-                return gaze_data[0], latency, gaze_data[2]
+                return AOI_TAGS[tag], latency, int(duration)
 
 
     def sort_gaze(self, nr_of_gazes=3, start_time=0):
@@ -160,11 +193,18 @@ class GazeCollection:
             print("Has initial gaze.")
             used_keys = outer_keys # to shift data
 
+        # gazes of the used ranks; the ones starting after start_time+2000ms are not filled
+        gazes = self._gazes[:len(used_keys)]
+        latencies = gazes["time"] - start_time
+        in_time = latencies <= 2000
+
         for i, k in enumerate(used_keys):
-            tag, latency, duration = self.get_gaze_data(gaze_nr=i+1, start_time=start_time)
-            d[(k,"object")]=tag
-            d[(k,"latency")]=latency
-            d[(k,"duration")]=duration * ST if duration else None
+            if i < len(gazes) and in_time[i]:
+                d[(k,"object")] = AOI_TAGS[gazes["tag"][i]]
+                d[(k,"latency")] = float(latencies[i])
+                d[(k,"duration")] = int(gazes["duration"][i]) * ST if gazes["duration"][i] else None
+            else:
+                d[(k,"object")], d[(k,"latency")], d[(k,"duration")] = None, None, None
 
         return d, responded
 
@@ -178,20 +218,13 @@ class GazeCollection:
         Returns
             cumulative gaze of each object kind proportional to all_gaze
         """
-        onint_gaze, onboring_gaze, onfam_gaze = 0,0,0
-        for k, v in self._dict.items():
-            if v[0] == "INT":
-                onint_gaze += v[2]
-            elif v[0] == "BOR":
-                onboring_gaze += v[2]
-            elif v[0] == "FAM":
-                onfam_gaze += v[2]
+
+        tag_durations = np.bincount(self._gazes["tag"], weights=self._gazes["duration"], minlength=len(AOI_TAGS))
+        onint_gaze, onboring_gaze, onfam_gaze = (tag_durations[AOI_TAGS.index(tag)] for tag in ("INT", "BOR", "FAM"))
 
         all_gaze = onint_gaze + onboring_gaze + onfam_gaze
-        onint = onint_gaze / all_gaze if all_gaze != 0 else 0
-        onboring = onboring_gaze / all_gaze if all_gaze != 0 else 0
-        onfam = onfam_gaze / all_gaze if all_gaze != 0 else 0
+        onint = float(onint_gaze / all_gaze) if all_gaze != 0 else 0
+        onboring = float(onboring_gaze / all_gaze) if all_gaze != 0 else 0
+        onfam = float(onfam_gaze / all_gaze) if all_gaze != 0 else 0
 
         return onint, onboring, onfam
-
-
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing and memory records of a pipeline run.
+
+    with instr.recording() as stages:      # collect the stages of a run or of a subject
+        with instr.stage("read") as st:    # time a block
+            df = ...
+            st["samples"] = len(df)        # optional sample count (for throughput)
+
+    @instr.timed("plotting")               # time every call of a function
+    def plot(...): ...
+
+The records of a recording are summed per stage name: calls, wall time, samples and memory:
+    peak_rss_mb: largest resident memory of the process during a call of the stage. On Linux the high-water
+        mark (VmHWM) is reset at the start of the stage; elsewhere it is the high-water mark of the process
+        (ru_maxrss) at the end of the stage, which only goes up during a run.
+    peak_traced_mb: largest increase of the traced memory (tracemalloc) during a call of the stage,
+        over the memory at its start. Only with recording(trace_memory=True), as tracing slows the run down.
+Outside of a recording stage() only runs the block, so the hooks can stay in the code.
+run_pipeline writes the report as json next to the run log (see write_report).
+"""
+
+import contextlib
+import functools
+import json
+import re
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # not on Windows
+    resource = None
+
+
+_recordings = [] # stack of ({stage name: totals}, trace_memory)
+_traced_stages = [] # stack of {"start", "peak"} traced memory of the running stages (see _trace_start)
+_rss_stages = [] # stack of the peak resident memory (MB) of the running stages (see _rss_start)
+
+
+@contextlib.contextmanager
+def recording(trace_memory=False):
+    """
+    Collects the stages run in the block into the yielded dict (nested recordings are separate).
+    trace_memory: also record the peak traced memory of the stages (starts tracemalloc if it isn't running)
+    """
+
+    stages = {}
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _recordings.append((stages, trace_memory))
+    try:
+        yield stages
+    finally:
+        _recordings.pop()
+        if started:
+            tracemalloc.stop()
+
+
+@contextlib.contextmanager
+def stage(name, samples=None):
+    """
+    Times the block as stage name. The yielded dict takes the "samples" processed
+    if they are only known at the end of the block.
+    """
+
+    info = {"samples": samples}
+    if not _recordings:
+        yield info
+        return
+
+    stages, trace_memory = _recordings[-1]
+    traced = trace_memory and tracemalloc.is_tracing()
+    if traced:
+        _trace_start()
+    rss_reset = _rss_start()
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_traced = _trace_end() if traced else None
+        peak_rss = _rss_end() if rss_reset else max_rss_mb()
+        totals = stages.setdefault(name, _new_totals())
+        totals["calls"] += 1
+        totals["wall_time"] += wall_time
+        totals["samples"] += info["samples"] or 0
+        if peak_rss is not None:
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"] or 0, peak_rss)
+        if peak_traced is not None:
+            totals["peak_traced_mb"] = round(max(totals["peak_traced_mb"] or 0, peak_traced), 1)
+
+
+def _new_totals():
+    return dict(calls=0, wall_time=0.0, samples=0, peak_rss_mb=None, peak_traced_mb=None)
+
+
+def _trace_start():
+    """
+    tracemalloc has one peak for the process: it is reset at the start of every stage,
+    the peak reached before is kept for the enclosing stage.
+    """
+
+    current, peak = tracemalloc.get_traced_memory()
+    if _traced_stages:
+        _traced_stages[-1]["peak"] = max(_traced_stages[-1]["peak"], peak)
+    tracemalloc.reset_peak()
+    _traced_stages.append(dict(start=current, peak=current))
+
+
+def _trace_end():
+    """ Peak traced memory of the stage over its start in MB (the enclosing stage keeps the peak). """
+
+    traced = _traced_stages.pop()
+    peak = max(traced["peak"], tracemalloc.get_traced_memory()[1])
+    if _traced_stages:
+        _traced_stages[-1]["peak"] = max(_traced_stages[-1]["peak"], peak)
+
+    return (peak - traced["start"]) / 2**20
+
+
+def _rss_start():
+    """
+    Resets the high-water mark of the resident memory (Linux only, False elsewhere) at the start of a stage,
+    the peak reached before is kept for the enclosing stage as in _trace_start.
+    """
+
+    peak = _vm_hwm_mb()
+    if peak is None:
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    if _rss_stages:
+        _rss_stages[-1] = max(_rss_stages[-1], peak)
+    _rss_stages.append(0.0)
+
+    return True
+
+
+def _rss_end():
+    """ Peak resident memory of the stage in MB (the enclosing stage keeps the peak). """
+
+    peak = max(_rss_stages.pop(), _vm_hwm_mb() or 0)
+    if _rss_stages:
+        _rss_stages[-1] = max(_rss_stages[-1], peak)
+
+    return round(peak, 1)
+
+
+def _vm_hwm_mb():
+    """ Resident memory high-water mark of the process in MB from /proc (None if not available). """
+
+    try:
+        with open("/proc/self/status") as f:
+            status = f.read()
+    except OSError:
+        return None
+    hwm = re.search(r"^VmHWM:\s+(\d+) kB", status, re.MULTILINE)
+
+    return int(hwm.group(1)) / 2**10 if hwm else None
+
+
+def timed(name):
+    """ Decorator: every call of the function is a stage. """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def max_rss_mb():
+    """ Resident memory high-water mark of the process in MB (None if not available). """
+
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return round(maxrss / 2**20 if sys.platform == "darwin" else maxrss / 2**10, 1)
+
+
+def summarize(stages):
+    """ Adds the throughput (samples/s) to the stage totals, rounds the times. """
+
+    summary = {}
+    for name, totals in stages.items():
+        totals = dict(totals)
+        wall_time = totals["wall_time"]
+        totals["samples_per_s"] = round(totals["samples"] / wall_time) if totals["samples"] and wall_time else None
+        totals["wall_time"] = round(wall_time, 4)
+        summary[name] = totals
+
+    return summary
+
+
+def write_report(path, run_stages, subject_stages, **info):
+    """
+    Writes the json report of a run.
+    run_stages: stages of the main process
+    subject_stages: {subj_nr: stages} of the processed logfiles (recorded in the worker processes)
+    info: added to the report as is (e.g. settings)
+    """
+
+    total = {}
+    for stages in subject_stages.values():
+        for name, totals in stages.items():
+            t = total.setdefault(name, _new_totals())
+            t["calls"] += totals["calls"]
+            t["wall_time"] += totals["wall_time"]
+            t["samples"] += totals["samples"]
+            for memory in ("peak_rss_mb", "peak_traced_mb"):
+                if totals[memory] is not None:
+                    t[memory] = max(t[memory] or 0, totals[memory])
+
+    report = dict(info,
+                  run=summarize(run_stages),
+                  subjects_total=summarize(total),
+                  subjects={subj_nr: summarize(stages) for subj_nr, stages in subject_stages.items()})
+
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1)
@@ -9,21 +9,23 @@ Only works if there's 2 trials altogether
 import datetime
 import os
 import pandas as pd
-import swifter
 from constants import DIR
 
 
-date = str(datetime.datetime.today().date())
-dir_name = os.path.join(DIR, "tables", date)
-output_excel = os.path.join(dir_name, f"curiosity_LT_aggregated_{date}.xlsx")
-
-def aggregate_data(ord_dict, timing):
+def aggregate_data(ord_dict, timing, dir_name=None, date=None):
     """
     Aggregates data from ord_dict
     ord_dict: dictionary with
         key: subject number
         value: a list of test results dataframe and gaze results dataframe
+    dir_name: output directory, default: tables/<date>
+    date: date string in the output names, default: today
     """
+    import swifter # registers the .swifter accessor; imported here as it is slow to import
+
+    date = date or str(datetime.datetime.today().date())
+    dir_name = dir_name or os.path.join(DIR, "tables", date)
+
     # get columns to use
     df_t, df_g = ord_dict[list(ord_dict.keys())[0]] # first subject's list of dfs
     test_cols = list(df_t.columns)[4:]
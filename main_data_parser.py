@@ -1,141 +1,318 @@
 # -*- coding: utf-8 -*-
 
+import concurrent.futures
 import datetime
+import itertools
 import os
 import logging
+import logging.handlers
+import multiprocessing
 import collections
 import pandas as pd
-import pickle
-import swifter
 import constants as c
-import reading_and_transformations as rt
 import gaze_calculations as calc
-import looking_time_aggregations as aggr
-import time_course_plotting as time_course
-
-pd.options.mode.chained_assignment = None
+import instrumentation as instr
+import session_cache
+from session import Session
+from run_config import RunConfig
+from results_store import ResultsStore
+from results_writer import ResultsWriter
+from time_course_store import TimeCourseStore
+# looking_time_aggregations and time_course_plotting (swifter, plotly) are imported by the stages using them
 
 
 ####################
+# default settings of main(); see RunConfig
 test = False
 save_to_file = True
 do_aggregation = True
 analyse_tc = False
-save_tc_pickle = True
+save_tc = True
 # test period. full time or up to start_time + 2000ms
 fulltime = False
+# nr of processes to parse the logfiles in parallel
+workers_nr = 1
+# keep the parsed and interpolated sessions in cache/sessions
+use_cache = True
+# only process new or changed logfiles, reuse the stored results of the others
+incremental = False
+# read the logfiles in chunks of this many rows (for very long recordings), None: in one go
+chunksize = None
+# format of the subject tables: "xlsx", "csv" or "parquet"
+output_format = "xlsx"
+# permutations of the cluster-based permutation test of the time course, 0: no test
+permutations = 10000
+# resamples of the bootstrap confidence bands of the time course (plots and tables), 0: SE bands
+bootstrap = 0
+# peak memory of each stage in the run report (tracemalloc, slower)
+trace_memory = False
 ####################
 
-logtime = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
-log = os.path.join(c.DIR, "runlogs", "curiosity_LT_parser_{0}.log".format(logtime))
-logging.basicConfig(filename=log, level=logging.DEBUG)
 
-date = str(datetime.date.today())
-dir_name = os.path.join(c.DIR, "tables", date)
-test_dir_name = os.path.join(c.DIR, "tables", "test_prints", date)
-tc_dfs_dir_name = os.path.join(c.DIR, "time_course", "subj_dataframes")
-pickle_jar = os.path.join(c.DIR, "time_course", "pickle")
+# AOI namedtuple
+AOI = collections.namedtuple("AOI", "inter, bor, fam1, fam2")
 
-timing = "4sec_test" if fulltime else "2sec_test"
-if test:
-    logfilespath = os.path.join(c.DIR, "data_to_read_TEST")
-    excelfile = os.path.join(test_dir_name, f"curiosity_looking_data_TEST_{timing}_{date}.xlsx")
-else:
-    logfilespath = os.path.join(c.DIR, "data_to_read")
-    excelfile = os.path.join(dir_name, f"curiosity_looking_data_{timing}_{date}.xlsx")
 
-writer = pd.ExcelWriter(excelfile)
 
+def main(workers=None):
+    """
+    Runs the pipeline with the module settings.
+    workers: nr of processes the logfiles are processed in parallel (default: module setting)
+    """
 
-# AOI namedtuple
-AOI = collections.namedtuple("AOI", "inter, bor, fam1, fam2")
+    config = RunConfig(test=test, save_to_file=save_to_file, do_aggregation=do_aggregation, analyse_tc=analyse_tc,
+                       save_tc=save_tc, fulltime=fulltime,
+                       workers=workers_nr if workers is None else workers, use_cache=use_cache,
+                       incremental=incremental, chunksize=chunksize,
+                       output_format=output_format, permutations=permutations, bootstrap=bootstrap,
+                       trace_memory=trace_memory)
 
+    return run_pipeline(config)
 
 
-def main():
+def run_pipeline(config):
+    """
+    Parses the logfiles, writes the results and runs the enabled analyses.
+    All directories, the log file and the excel writer of the run belong to the call;
+    the root logger level and the pandas chained_assignment option are only changed during the call.
+    config: RunConfig
+    returns:
+        ord_dict: {subj_nr: [test_results_df, gaze_results_df]} of valid subjects
+        time_course_dict: {subj_nr: time_course_d} of valid subjects
+    """
+
+    _make_directories([config.dir_name, config.test_dir_name, os.path.dirname(config.tc_store_path), config.runlogs_dir])
+
+    logtime = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M")
+    log_handler = logging.FileHandler(os.path.join(config.runlogs_dir, f"curiosity_LT_parser_{logtime}.log"))
+    root_logger = logging.getLogger()
+    root_level = root_logger.level
+    root_logger.addHandler(log_handler)
+    root_logger.setLevel(logging.DEBUG)
 
-    _make_directories([dir_name, test_dir_name, pickle_jar])
+    # stage timings of the run, written next to the log
+    with instr.recording(config.trace_memory) as run_stages, pd.option_context("mode.chained_assignment", None):
+
+        try:
+            with instr.stage("parse_logfiles"):
+                ord_dict, time_course_dict, subject_stages = _parse_logfiles(config)
+        finally:
+            root_logger.removeHandler(log_handler)
+            root_logger.setLevel(root_level)
+            log_handler.close()
+
+        if config.do_aggregation:
+            with instr.stage("aggregation"):
+                import looking_time_aggregations as aggr
+                aggr.aggregate_data(ord_dict, config.timing, dir_name=config.dir_name, date=config.date)
+
+        if config.analyse_tc:
+            with instr.stage("time_course"):
+                import time_course_plotting as time_course
+                time_course.analyse_time_course(time_course_dict, plots_dir=config.plots_dir,
+                                                tables_dir=config.tc_tables_dir, n_permutations=config.permutations,
+                                                n_resamples=config.bootstrap, workers=config.workers)
+
+        if config.save_tc:
+            # save time_course_dict in the time course store (time_course_plotting.open_time_course)
+            with instr.stage("save_tc"):
+                TimeCourseStore.from_dict(time_course_dict).save(config.tc_store_path)
+                print("time course saved")
+
+    instr.write_report(os.path.join(config.runlogs_dir, f"curiosity_LT_parser_{logtime}.json"),
+                       run_stages, subject_stages, logtime=logtime, workers=config.workers,
+                       use_cache=config.use_cache, incremental=config.incremental, chunksize=config.chunksize,
+                       output_format=config.output_format, timing=config.timing, trace_memory=config.trace_memory)
+
+    return ord_dict, time_course_dict
+
+
+def _parse_logfiles(config):
+    """
+    Processes the logfiles (in parallel if config.workers > 1) and writes the subject sheets.
+    In incremental mode only new or changed logfiles are processed, the results of the others
+    are loaded from the results store.
+    Also returns the stage timings of the logfiles processed in this run: {subj_nr: stages}
+    """
 
     ord_dict = {}
     time_course_dict = {}
+    subject_stages = {}
 
+    logfilespath = config.logfilespath
     logfiles = [f for f in sorted(os.listdir(logfilespath)) if os.path.isfile(os.path.join(logfilespath, f))]
 
-    for log in logfiles:
-        print(f"\nReading file {log}")
+    if config.incremental:
+        store = ResultsStore(config.results_dir)
+        store.prune(logfiles)
+        new_logfiles = [log for log in logfiles if not store.is_current(log, os.path.join(logfilespath, log))]
+        print(f"{len(new_logfiles)} new or changed logfiles, {len(logfiles) - len(new_logfiles)} stored results")
 
-        # check date of logfile
-        datestring = log.split("_")[3]
-        logdate = datetime.datetime.strptime(datestring, "%Y-%m-%d")
-        feb24 = datetime.datetime(2020, 2, 24)
-        oldlog = logdate < feb24
+        for log, result in zip(new_logfiles, _process_logfiles(new_logfiles, config)):
+            subject_stages[result["subj_nr"]] = result["stages"]
+            store.save(log, os.path.join(logfilespath, log), result)
+        store.write_manifest()
 
-        logfilepath = os.path.join(logfilespath, log)
+        results = (store.load(log) for log in logfiles)
+    else:
+        results = _process_logfiles(logfiles, config)
 
-        df = rt.read_tsv_file(logfilepath)
-        subj_nr = log.split("_")[0]
+    writer = ResultsWriter(config.excelfile, output_format=config.output_format) if config.save_to_file else None
 
-        if df is None:
-            print(f"!!!WARNING! The file '{log}' is compromised. Please check.")
-            break
+    for result in results:
 
-        df_events, df = rt.detach_events(df)
-        events = df_events["Event"].tolist()
+        if not config.incremental:
+            subject_stages[result["subj_nr"]] = result["stages"]
 
-        # if exp was not completed, don't bother
-        if not check_if_completed(events, subj_nr):
+        # stop at the first compromised or not completed file
+        if result["status"] != "ok":
             break
 
-        df = rt.interpolate_missing_samples(df)
-
-        # objects holding logged times and events
-        fam = c.Fam_data(df_events)
-        teaching = c.Teaching_data(df_events, oldlog)
-        test = c.Test_controll_data(df_events, oldlog)
+        subj_nr = result["subj_nr"]
 
-        valid1 = parse_introduction_data(df, fam, subj_nr)
-        valid2 = parse_familiarisation_data(df, teaching, subj_nr)
-        test_results_df, gaze_results_df, time_course_d = parse_test_data(df, test, subj_nr)
+        if writer is not None:
+            for name, df, index, startrow in result["sheets"]:
+                writer.add(subj_nr, name, df, index=index, startrow=startrow)
 
-        if valid1 and valid2:
+        if result["valid"]:
 
             # add time_course dict to main dict to send
-            time_course_dict[subj_nr] = time_course_d
-            # reset index of gaze_df from labels to default
-            gaze_results_df.reset_index(drop=True, inplace=True)
-            # flatten multi-level columns and create string column name from tuple
-            gaze_results_df.columns = [" ".join(col) for col in gaze_results_df.columns.to_flat_index()]
+            time_course_dict[subj_nr] = result["time_course_d"]
             # add dfs to main dict
-            ord_dict[subj_nr] = [test_results_df, gaze_results_df]
+            ord_dict[subj_nr] = [result["test_results_df"], result["gaze_results_df"]]
 
+    if writer is not None:
+        with instr.stage("write_tables"):
+            writer.close()
+        if config.output_format == "xlsx":
+            print("Excel file with separate subject sheets is saved.")
+        else:
+            print(f"Subject tables are saved in {writer.path}")
+
+    return ord_dict, time_course_dict, subject_stages
 
-    if save_to_file:
-        writer.save()
-        print("Excel file with separate subject sheets is saved.")
 
-    if do_aggregation:
-        aggr.aggregate_data(ord_dict, timing)
+def _process_logfiles(logfiles, config):
+    """ Returns the results of process_logfile in the order of logfiles. """
+
+    if config.workers > 1:
+        # the workers log through a queue to the handlers of this process (the run log)
+        log_queue = multiprocessing.Queue()
+        listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+        listener.start()
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=config.workers, initializer=_init_worker_logging,
+                                                        initargs=(log_queue,)) as executor:
+                return list(executor.map(process_logfile, logfiles, itertools.repeat(config)))
+        finally:
+            listener.stop()
 
-    if analyse_tc:
-        time_course.analyse_time_course(time_course_dict)
+    return (process_logfile(log, config) for log in logfiles)
 
-    if save_tc_pickle:
-        # save time_course_dict in a pickle
-        with open(os.path.join(pickle_jar, f"tc_dict_{timing}_{date}" + '.pkl'), 'wb') as f:
-            pickle.dump(time_course_dict, f, pickle.HIGHEST_PROTOCOL)
-            print("pickle file saved")
 
+def _init_worker_logging(log_queue):
+    """ Worker process initializer: all records go to log_queue (see _process_logfiles). """
+
+    root_logger = logging.getLogger()
+    root_logger.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root_logger.setLevel(logging.DEBUG)
+
+
+def process_logfile(log, config):
+    """
+    Reads and parses the logfile of a subject.
+    Only depends on the logfile, so it can run in a worker process.
+    returns:
+        dict with
+            subj_nr
+            status: "ok", "compromised" or "not completed"
+            valid: intro and teaching were valid
+            sheets: list of (name, df, index, startrow) to write to the subject's sheet
+            test_results_df, gaze_results_df, time_course_d (see parse_test_data)
+            stages: stage timings of the logfile (see instrumentation)
+    """
+
+    # also set here for the worker processes
+    with instr.recording(config.trace_memory) as stages, pd.option_context("mode.chained_assignment", None):
+        with instr.stage("process_logfile"):
+            result = _process_logfile(log, config)
+    result["stages"] = stages
 
+    return result
 
-def parse_introduction_data(df, fam, subj_nr):
 
-    fam_onscreen = _calculate_onscreen_look(df, fam.start_times, fam.end_times)
-    fam_label_onscreen = _calculate_onscreen_look(df, fam.label_start_times, fam.label_end_times)
+def _process_logfile(log, config):
+
+    print(f"\nReading file {log}")
+
+    subj_nr = log.split("_")[0]
+    result = dict(subj_nr=subj_nr, status="ok", valid=False, sheets=[],
+                  test_results_df=None, gaze_results_df=None, time_course_d=None)
+
+    # check date of logfile
+    datestring = log.split("_")[3]
+    logdate = datetime.datetime.strptime(datestring, "%Y-%m-%d")
+    feb24 = datetime.datetime(2020, 2, 24)
+    oldlog = logdate < feb24
+
+    logfilepath = os.path.join(config.logfilespath, log)
+
+    # read, detach events, interpolate (or load the result from the cache)
+    df_events, df = session_cache.read_session(logfilepath, cache_dir=config.cache_dir if config.use_cache else None,
+                                               chunksize=config.chunksize)
+
+    if df is None:
+        print(f"!!!WARNING! The file '{log}' is compromised. Please check.")
+        result["status"] = "compromised"
+        return result
+
+    events = df_events["Event"].tolist()
+
+    # if exp was not completed, don't bother
+    if not check_if_completed(events, subj_nr):
+        result["status"] = "not completed"
+        return result
+
+    # aoi tags are computed once per layout for the whole session
+    try:
+        session = Session(df)
+    except ValueError as e:
+        print(f"!!!WARNING! The file '{log}' is compromised: {e} Please check.")
+        result["status"] = "compromised"
+        return result
+
+    # objects holding logged times and events
+    fam = c.Fam_data(df_events)
+    teaching = c.Teaching_data(df_events, oldlog)
+    test = c.Test_controll_data(df_events, oldlog)
+
+    sheets = result["sheets"]
+    valid1 = parse_introduction_data(session, fam, subj_nr, sheets)
+    valid2 = parse_familiarisation_data(session, teaching, subj_nr, sheets)
+    test_results_df, gaze_results_df, time_course_d = parse_test_data(session, test, subj_nr, sheets,
+                                                                      fulltime=config.fulltime)
+
+    if valid1 and valid2:
+
+        # reset index of gaze_df from labels to default
+        gaze_results_df = gaze_results_df.reset_index(drop=True)
+        # flatten multi-level columns and create string column name from tuple
+        gaze_results_df.columns = [" ".join(col) for col in gaze_results_df.columns.to_flat_index()]
+
+        result.update(valid=True, test_results_df=test_results_df, gaze_results_df=gaze_results_df,
+                      time_course_d=time_course_d)
+
+    return result
+
+
+def parse_introduction_data(session, fam, subj_nr, sheets):
+
+    fam_onscreen = _calculate_onscreen_look(session, fam.start_times, fam.end_times)
+    fam_label_onscreen = _calculate_onscreen_look(session, fam.label_start_times, fam.label_end_times)
 
     output_fam = pd.DataFrame({"Fam_objs_LT-screen": fam_onscreen,"Fam_labeling_LT-screen":fam_label_onscreen})
 
-    if save_to_file:
-        write_results_to_file(output_fam, subj_nr, index=False, startrow=0)
+    sheets.append(("intro", output_fam, False, 0))
 
     if (
         (sum(fam_onscreen)/len(fam_onscreen) < 0.6) or
@@ -147,12 +324,12 @@ def parse_introduction_data(df, fam, subj_nr):
     return True
 
 
-def parse_familiarisation_data(df, teaching, subj_nr):
+def parse_familiarisation_data(session, teaching, subj_nr, sheets):
 
     start_times, end_times = teaching.start_times, teaching.end_times
 
-    teaching_demo_onscreen = _calculate_onscreen_look(df, start_times, end_times)
-    teaching_label_onscreen = _calculate_onscreen_look(df, teaching.label_start_times, teaching.label_end_times)
+    teaching_demo_onscreen = _calculate_onscreen_look(session, start_times, end_times)
+    teaching_label_onscreen = _calculate_onscreen_look(session, teaching.label_start_times, teaching.label_end_times)
 
     teaching_interesting_sides = teaching.interesting_sides
     logging.info("Subject: {0} \nFamiliarisation interesting sides: {1}".format(subj_nr, teaching_interesting_sides))
@@ -165,9 +342,7 @@ def parse_familiarisation_data(df, teaching, subj_nr):
                   bor=c.AOI_right if int_side == "left" else c.AOI_left,
                   fam1=None, fam2=None)
 
-        start, end = start_times[n], end_times[n]
-        teaching_df = df[(df["TimeStamp"] > start) & (df["TimeStamp"] < end)]
-        teaching_df = rt.assign_aoi_tags(teaching_df, aoi)
+        teaching_df = session.window(start_times[n], end_times[n], aoi=aoi)
         teach_gaze = calc.collect_gaze(teaching_df)
         teaching_onint_gaze = teach_gaze.calculate_onobject_gaze()[0]
         teaching_onint.append(teaching_onint_gaze)
@@ -175,8 +350,7 @@ def parse_familiarisation_data(df, teaching, subj_nr):
     output_new = pd.DataFrame({"New_objs_LT-screen": teaching_demo_onscreen, "New_objs_LT-interesting": teaching_onint,
                                 "New_labeling_LT-screen": teaching_label_onscreen})
 
-    if save_to_file:
-        write_results_to_file(output_new, subj_nr, index=False, startrow=7)
+    sheets.append(("teaching", output_new, False, 7))
 
     if (
         (sum(teaching_demo_onscreen)/len(teaching_demo_onscreen) < 0.6) or
@@ -188,35 +362,34 @@ def parse_familiarisation_data(df, teaching, subj_nr):
     return True
 
 
-def parse_baseline_data(df, aoi, start_time=None, end_time=None):
+def parse_baseline_data(session, aoi, start_time=None, end_time=None):
     """
     Baselines are calculated in proportion to the sum gaze to the interesting, boring
     and familar objects.
     """
 
-    bl_df = df[(df["TimeStamp"] > start_time) & (df["TimeStamp"] < end_time)]
-    bl_df = rt.assign_aoi_tags(bl_df, aoi)
+    bl_df = session.window(start_time, end_time, aoi=aoi)
     bl_gaze = calc.collect_gaze(bl_df)
     bl_onint, bl_onboring, bl_onfam = bl_gaze.calculate_onobject_gaze()
 
     return bl_onint, bl_onboring, bl_onfam
 
 
-def check_att_getter_gaze(df, test, n, aoi):
+def check_att_getter_gaze(session, test, n, aoi):
 
     start = test.ag_start_times[n]
     end = test.start_times[n]
 
-    ag_df = df[(df["TimeStamp"] > start) & (df["TimeStamp"] < end)]
-    ag_df = rt.assign_aoi_tags(ag_df, aoi, aoi_ag=c.AOI_ag)
+    ag_df = session.window(start, end, aoi=aoi, aoi_ag=c.AOI_ag)
     ag_gaze = calc.collect_gaze(ag_df)
     gazed_at_ag = True if "ATT" in ag_gaze.get_taglist() else False
 
     return gazed_at_ag
 
 
-def parse_test_data(df, test, subj_nr):
+def parse_test_data(session, test, subj_nr, sheets, fulltime=False):
     """
+    fulltime: test period. full time or up to start_time + 2000ms
     returns:
         test_results_df from test_dict:
 
@@ -246,8 +419,8 @@ def parse_test_data(df, test, subj_nr):
     if not check_tests_validity(len(end_times)): return
 
     # onscreen results
-    bl_onscreen = _calculate_onscreen_look(df, test.bl_start_times, test.ag_start_times)
-    test_onscreen = _calculate_onscreen_look(df, start_times, end_times)
+    bl_onscreen = _calculate_onscreen_look(session, test.bl_start_times, test.ag_start_times)
+    test_onscreen = _calculate_onscreen_look(session, start_times, end_times)
 
 
     for n in range(len(end_times)): # n: trial nr
@@ -263,7 +436,7 @@ def parse_test_data(df, test, subj_nr):
               fam2=c.AOI_dict[int_side][3])
 
         # check att getter fixation
-        gazed_at_ag = check_att_getter_gaze(df, test, n, aoi)
+        gazed_at_ag = check_att_getter_gaze(session, test, n, aoi)
 
         # check validity
         if (
@@ -274,7 +447,7 @@ def parse_test_data(df, test, subj_nr):
             valid = False
 
         # parse baseline in round
-        bl_onint, bl_onboring, bl_onfam, = parse_baseline_data(df, aoi,
+        bl_onint, bl_onboring, bl_onfam, = parse_baseline_data(session, aoi,
                                                     start_time=test.bl_start_times[n],
                                                     end_time=test.ag_start_times[n])
 
@@ -284,8 +457,7 @@ def parse_test_data(df, test, subj_nr):
             test_start, test_end = start_times[n]-339, end_times[n]
         else:
             test_start, test_end = start_times[n]-339, start_times[n]+2000
-        test_df = df[(df["TimeStamp"] >= test_start) & (df["TimeStamp"] <= test_end)]
-        test_df = rt.assign_aoi_tags(test_df, aoi)
+        test_df = session.window(test_start, test_end, include_start=True, include_end=True, aoi=aoi)
         test_all_gaze_coll = calc.collect_gaze(test_df)
 
         test_onint_gaze, test_onboring_gaze, test_onfam_gaze = test_all_gaze_coll.calculate_onobject_gaze()
@@ -341,24 +513,16 @@ def parse_test_data(df, test, subj_nr):
         test_results_df = pd.DataFrame(test_dict).T
         gaze_results_df = pd.DataFrame(gaze_dict).T
 
-    if save_to_file:
-        write_results_to_file(test_results_df, subj_nr, index=False, startrow=15)
-        write_results_to_file(gaze_results_df, subj_nr, index=True, startrow=21)
+    sheets.append(("test", test_results_df, False, 15))
+    sheets.append(("gaze", gaze_results_df, True, 21))
 
     return test_results_df, gaze_results_df, time_course_d
 
 
-def _calculate_onscreen_look(dataframe, start_times, end_times):
+def _calculate_onscreen_look(session, start_times, end_times):
     """ returns a list of proportional looking times on screen for each trial"""
 
-    onscreen_looks = []
-
-    for n in range(len(start_times)):
-        df = dataframe[(dataframe["TimeStamp"] >= start_times[n]) & (dataframe["TimeStamp"]< end_times[n])]
-        valid_times = df["gazepoints"].swifter.progress_bar(False).apply(lambda x : x != "invalid").sum()
-        onscreen_looks.append(valid_times / df["gazepoints"].size)
-
-    return onscreen_looks
+    return session.onscreen_proportions(start_times, end_times).tolist()
 
 
 ### Checkups ###
@@ -380,25 +544,6 @@ def check_tests_validity(n):
         return True
 
 
-### Print, round ###
-def write_results_to_file(df, subj_nr, index=False, startrow=15):
-    """
-    Writes input df to file excel file.
-    """
-
-    def round_numbers(x):
-
-        if isinstance(x, (float, complex)):
-            return round(float(x),3)
-        else:
-            return x
-
-    # rounding
-    df = df.applymap(round_numbers)
-    df.to_excel(writer, sheet_name=subj_nr, index=index, startrow=startrow)
-
-
-
 ## for testing
 def print_dataframes(df, subj_nr, filename):
 
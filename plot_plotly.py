@@ -4,27 +4,41 @@
 """
 
 import pandas as pd
-pd.options.mode.chained_assignment = None
 import numpy as np
 import os
 import datetime
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+import instrumentation as instr
 from constants import DIR, ST
 
 
-date = str(datetime.datetime.today().date())
+def _plots_dir(plots_dir=None):
+    """ Returns (and creates) the plots directory, default: time_course/plots/<today> """
 
-plots_dir = os.path.join(DIR, "time_course", "plots", f"{date}")
-try:
-    os.makedirs(plots_dir)
-except FileExistsError:
-    pass
+    if plots_dir is None:
+        date = str(datetime.datetime.today().date())
+        plots_dir = os.path.join(DIR, "time_course", "plots", f"{date}")
+    os.makedirs(plots_dir, exist_ok=True)
+
+    return plots_dir
+
+
+def _band(df):
+    """ Bounds of the band around the mean: the bootstrap confidence band if df has one, else mean +- SE. """
+
+    if "CI_lower" in df.columns:
+        return df["CI_lower"], df["CI_upper"], "bootstrap CI"
+
+    return df["sample_mean"] - df["SE"], df["sample_mean"] + df["SE"], "SE"
 
 
 # plot one plot
-def plot_plotly1(df, label, obj, n):
+@instr.timed("plotting")
+def plot_plotly1(df, label, obj, n, plots_dir=None):
+
+    lower, upper, band = _band(df)
 
     fig = make_subplots(
     rows=2, cols=1,
@@ -37,7 +51,7 @@ def plot_plotly1(df, label, obj, n):
     upper_bound = go.Scatter(
         name="upper bound",
         x=df["time"],
-        y=df["sample_mean"]+df["SE"],
+        y=upper,
         mode="lines",
         marker=dict(color="#444"),
         line=dict(width=0),
@@ -60,7 +74,7 @@ def plot_plotly1(df, label, obj, n):
     lower_bound = go.Scatter(
         name="lower bound",
         x=df["time"],
-        y=df["sample_mean"]-df["SE"],
+        y=lower,
         marker=dict(color="#444"),
         line=dict(width=0),
         mode='lines')
@@ -71,7 +85,7 @@ def plot_plotly1(df, label, obj, n):
     layout = go.Layout(
         yaxis=dict(title="Proportion"),
         xaxis=dict(title="Time in ms"),
-        title=dict(text=f"<b>{obj} object look in {label} label trials</b> (baseline corrected mean with SE); N <= {n}"+
+        title=dict(text=f"<b>{obj} object look in {label} label trials</b> (baseline corrected mean with {band}); N <= {n}"+
         "<br>Label onset: x = 0"),
         showlegend = False,
         annotations=[
@@ -122,13 +136,14 @@ def plot_plotly1(df, label, obj, n):
     yticks = np.linspace(-1,1,17)
     fig.update_yaxes(tickvals=yticks, ticks="outside", tickwidth=2, tickcolor='crimson', ticklen=10)
 
-    pic = os.path.join(plots_dir, f"{label}_timecourse_{obj}_object_look.html")
+    pic = os.path.join(_plots_dir(plots_dir), f"{label}_timecourse_{obj}_object_look.html")
     fig.write_html(file=pic)
     fig.show()
 
 
 # plot two subplots
-def plot_plotly2(df, label, obj, n):
+@instr.timed("plotting")
+def plot_plotly2(df, label, obj, n, plots_dir=None):
     """
     plot 2 suplots:
         upper: valid datapoints (subjects) along the timeline
@@ -147,6 +162,8 @@ def plot_plotly2(df, label, obj, n):
     specs=[[{"type": "scatter"}],
            [{"type": "scatter"}]])
 
+    lower, upper, band = _band(df)
+
     ## SUBPLOTS
     # upper subplot
     datapoints = go.Scatter(
@@ -163,7 +180,7 @@ def plot_plotly2(df, label, obj, n):
     upper_bound = go.Scatter(
         name="upper bound",
         x=time_range,
-        y=df["sample_mean"]+df["SE"],
+        y=upper,
         mode="lines",
         marker=dict(color="#444"),
         line=dict(width=0),
@@ -187,7 +204,7 @@ def plot_plotly2(df, label, obj, n):
     lower_bound = go.Scatter(
         name="lower bound",
         x=time_range,
-        y=df["sample_mean"]-df["SE"],
+        y=lower,
         marker=dict(color="#444"),
         line=dict(width=0),
         mode='lines')
@@ -218,7 +235,7 @@ def plot_plotly2(df, label, obj, n):
     fig.update_layout(
             shapes=shapes,
             title=dict(text=f"<b>Look on {obj} in {label} label trials ({timing})</b>" +
-                       " (baseline corrected mean with SE)" +
+                       f" (baseline corrected mean with {band})" +
                        f"<br>Upper plot: nr of active looks; N <= {N}"),
             showlegend = False,
             annotations=[dict(x=0, y=-0.9,
@@ -261,7 +278,7 @@ def plot_plotly2(df, label, obj, n):
     else:
         pic_title = f"timecourse_Common_vs_New_objects_look_in_{label}_label_trials_({timing}_{n}kids).html"
 
-    pic = os.path.join(plots_dir, pic_title)
+    pic = os.path.join(_plots_dir(plots_dir), pic_title)
     fig.write_html(file=pic)
     print("plotted")
     fig.show()
\ No newline at end of file
@@ -3,46 +3,141 @@
 Reading, recoding, tagging, interpolating Tobii T60XL eye tracker data
 """
 
+import functools
 import pandas as pd
 import numpy as np
-import math
-import swifter
 
+from constants import AOI_TAGS, DS
 
-def read_tsv_file(logfilepath):
+
+def read_tsv_file(logfilepath, engine="c"):
     """
-    Reads datafile, validates format, creates 'gazepoints' column.
+    Reads datafile, validates format, creates the gaze columns:
+        'x', 'y': float32 gaze coordinates
+        'valid': False where the eye tracker lost the gaze (-1,-1)
     Drops unneded columns.
     Returns dataframe.
+    ----------
+    engine: "c" (default) or "pyarrow" are the fast parsers (only the used columns are read),
+        "python" is the original (slow) reader. The format is validated the same way for all.
     """
 
-    def check_df_format(df):
-
-        cols = ["TimeStamp","GazePointX", "GazePointY"]
-        for c in cols:
-            if df[c].dtype != float:
-                print(f"WARNING! Experiment data has an invalid column: {c}!")
-                return None
-        return df
-
     usecols=["TimeStamp", "Event", "GazePointX", "GazePointY"]
-    df = (
-        pd.read_csv(logfilepath, sep="\t", usecols=usecols, engine="python")
-        .pipe(check_df_format)
-          )
-    df["gazepoints"] = [(x,y) if (x,y) != (-1,-1) else "invalid"
-                                          for x,y in zip(df["GazePointX"], df["GazePointY"])]
+
+    if engine == "python":
+        df = pd.read_csv(logfilepath, sep="\t", usecols=usecols, engine="python")
+    else:
+        # round_trip: same float parsing as the python engine
+        options = {} if engine == "pyarrow" else {"float_precision": "round_trip"}
+        df = pd.read_csv(logfilepath, sep="\t", usecols=usecols, engine=engine, **options)
+
+    df = df.pipe(_check_df_format)
+    if df is None:
+        return None
+
+    x, y = df["GazePointX"], df["GazePointY"]
+    df["x"] = x.astype(np.float32)
+    df["y"] = y.astype(np.float32)
+    df["valid"] = ~((x == -1) & (y == -1))
     df.drop(labels=["GazePointX", "GazePointY"], axis=1, inplace=True)
 
     return df
 
 
+def _check_df_format(df):
+    """ The timestamps and gaze coordinates have to be read as floats, returns None otherwise. """
+
+    cols = ["TimeStamp","GazePointX", "GazePointY"]
+    for c in cols:
+        if df[c].dtype != float:
+            print(f"WARNING! Experiment data has an invalid column: {c}!")
+            return None
+    return df
+
+
+def read_tsv_file_chunked(logfilepath, chunksize=100000):
+    """
+    Streaming version of read_tsv_file + detach_events for very long recordings:
+    reads the datafile in chunks of chunksize rows and routes the event rows and the gaze rows
+    into their own buffers, so only one chunk of the file is in memory at a time.
+    Returns the events dataframe and the gaze dataframe (same as detach_events(read_tsv_file(...)))
+    or None, None if the file is compromised.
+    """
+
+    usecols=["TimeStamp", "Event", "GazePointX", "GazePointY"]
+    cols = ["TimeStamp","GazePointX", "GazePointY"]
+
+    event_chunks = []
+    gaze_buffers = {"index": [], "TimeStamp": [], "x": [], "y": [], "valid": []}
+    float_cols = set() # columns read as float in any chunk
+
+    reader = pd.read_csv(logfilepath, sep="\t", usecols=usecols, float_precision="round_trip", chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            # the same format validation as read_tsv_file, for the whole file:
+            # a chunk without event rows (empty gaze cells) can have integer columns,
+            # but a column has to be float in at least one chunk
+            for c in cols:
+                if chunk[c].dtype == float:
+                    float_cols.add(c)
+                elif pd.api.types.is_integer_dtype(chunk[c].dtype):
+                    chunk[c] = chunk[c].astype(np.float64)
+                else:
+                    print(f"WARNING! Experiment data has an invalid column: {c}!")
+                    return None, None
+
+            is_event = chunk["Event"].notna().to_numpy()
+            if is_event.any():
+                event_chunks.append(chunk.loc[is_event, ["TimeStamp", "Event"]])
+
+            gaze = chunk[~is_event]
+            x, y = gaze["GazePointX"].to_numpy(), gaze["GazePointY"].to_numpy()
+            gaze_buffers["index"].append(gaze.index.to_numpy())
+            gaze_buffers["TimeStamp"].append(gaze["TimeStamp"].to_numpy())
+            gaze_buffers["x"].append(x.astype(np.float32))
+            gaze_buffers["y"].append(y.astype(np.float32))
+            gaze_buffers["valid"].append(~((x == -1) & (y == -1)))
+
+    for c in cols:
+        if c not in float_cols:
+            print(f"WARNING! Experiment data has an invalid column: {c}!")
+            return None, None
+
+    if event_chunks:
+        df_events = pd.concat(event_chunks)
+    else:
+        df_events = pd.DataFrame({"TimeStamp": np.empty(0), "Event": np.empty(0, dtype=object)})
+
+    # concatenate column by column, freeing the buffers as we go
+    gaze_columns = {}
+    for col in list(gaze_buffers):
+        buffers = gaze_buffers.pop(col)
+        gaze_columns[col] = np.concatenate(buffers) if buffers else np.empty(0)
+        del buffers
+    index = pd.Index(gaze_columns.pop("index").astype(np.int64, copy=False))
+    df = pd.DataFrame(gaze_columns, index=index)
+
+    return df_events, df
+
+
+def add_gazepoints_column(df):
+    """
+    Adds the legacy 'gazepoints' column: (x,y) tuples or "invalid".
+    Only for backward compatibility, the pipeline works on the 'x', 'y', 'valid' columns.
+    """
+
+    gazepoints = pd.Series(list(zip(df["x"].tolist(), df["y"].tolist())), index=df.index, dtype=object)
+    gazepoints[~df["valid"].to_numpy()] = "invalid"
+
+    return df.assign(gazepoints=gazepoints)
+
+
 def detach_events(df):
     """
     Divides dataframe into a df containing only events and another df containing gaze data
     """
 
-    df_events = df.drop(["gazepoints"], axis=1) # creates a copy
+    df_events = df.drop(["x", "y", "valid"], axis=1) # creates a copy
     df_events = df_events[df_events["Event"].notna()]
 
     df = df[df["Event"].isna()]
@@ -60,115 +155,176 @@ def interpolate_missing_samples(df, freq=60, max_gap_length=101):
         - there are two-two valid samples on both ends of the gap
     """
 
-    # set new indexes to iterate over while keeping original as a column
+    # set new indexes while keeping original as a column
     df = df.assign(original_index=df.index, new_index=range(len(df.index)))
     df.set_index("new_index", inplace=True)
 
-    s_gp = df["gazepoints"]
+    x = df["x"].to_numpy(copy=True)
+    y = df["y"].to_numpy(copy=True)
+    valid = df["valid"].to_numpy(copy=True)
 
     sample_time = 1000/freq
     max_sample_nr = int(max_gap_length / sample_time) # 6
 
-    startindex = s_gp.index[2]
-    lastindex = s_gp.index[-3]
+    starts, ends = _find_gaps(valid, max_sample_nr)
+    if starts.size:
+        counters = ends - starts
+        # positions of all samples to fill and their place (1..counter) within the gap
+        gap_nr = np.repeat(np.arange(starts.size), counters)
+        positions = np.arange(counters.sum()) - np.repeat(np.cumsum(counters) - counters, counters)
+        indices = starts[gap_nr] + positions
+        steps = (positions + 1).astype(np.float64)
+
+        for coords in (x, y):
+            prec = coords[starts-1].astype(np.float64)
+            foll = coords[ends].astype(np.float64)
+            coord_step = (foll - prec) / (counters + 1)
+            coords[indices] = prec[gap_nr] + steps * coord_step[gap_nr]
+        valid[indices] = True
+
+    df = df.assign(x=x, y=y, valid=valid)
+    return df
 
-    i = startindex
-    while i <= lastindex:
 
-        if s_gp[i] == "invalid":
+def _find_gaps(valid, max_sample_nr):
+    """
+    Run-length encodes the invalid samples and returns the start and end (exclusive) positions
+    of the gaps to interpolate:
+        - at most max_sample_nr samples long
+        - two-two valid samples on both ends (so not closer than 2 samples to the ends of the data)
+    """
 
-            counter = 1
-            j = i+1
-            start = i
-            while (j <= lastindex) and (s_gp[j] ==  "invalid"):
-                counter += 1
-                j = j+1
+    n = len(valid)
+    edges = np.diff(np.concatenate(([0], (~valid).astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
 
-            if counter <= max_sample_nr:
+    # gaps are maximal runs, so samples start-1 and end are valid
+    keep = (starts >= 2) & (ends <= n-2) & (ends - starts <= max_sample_nr)
+    starts, ends = starts[keep], ends[keep]
+    keep = valid[starts-2] & valid[ends+1]
 
-                # chech for 2-2 valid samples on both ends
-                indices_to_check = [start-2, start-1, j, j+1]
-                checked_samples = [s_gp[ind] for ind in indices_to_check]
-                if "invalid" not in checked_samples:
+    return starts[keep], ends[keep]
 
-                    prec_sample = s_gp[start-1]
-                    foll_sample = s_gp[j]
-                    fill_values = _calculate_fill_values(prec_sample, foll_sample, counter)
-                    s_gp[start:j] = fill_values
 
-            i = j+1
+def assign_aoi_tags(df, aoi, aoi_ag=None):
+    """
+    Adds "aoi" column containing an aoi tag for each gazepoint (x, y, valid columns).
+    The column is categorical: int8 codes of AOI_TAGS.
+    ----------
+    aoi: collections.namedtuple
+    """
+
+    codes = aoi_tag_codes(df["x"].to_numpy(), df["y"].to_numpy(), df["valid"].to_numpy(), aoi, aoi_ag=aoi_ag)
 
-        else:
-            i = i+1
+    # add "aoi" columns with aoi tags
+    df = df.assign(aoi = pd.Categorical.from_codes(codes, categories=AOI_TAGS))
 
-    df = df.assign(gazepoints = s_gp)
     return df
 
 
-def _calculate_fill_values(prec_sample, foll_sample, counter):
+def aoi_tag_codes(x, y, valid, aoi, aoi_ag=None):
     """
-    Calculates the values to fill a gap with in interpolation.
+    Tags gazepoints with the aoi they are in, all gazepoints at once.
+    An AOI contains a point if it is within the rectangle (borders included).
+    In case of overlapping AOIs the priority is INT > BOR > ATT > FAM > OUT.
+    ----------
+    x, y, valid: arrays of the gaze coordinates and validity
+    aoi: collections.namedtuple (inter, bor, fam1, fam2); fam1, fam2 can be None
+    aoi_ag: attention getter AOI or None
+    returns:
+        int8 array of AOI_TAGS codes
     """
 
-    x1 = prec_sample[0]
-    y1 = prec_sample[1]
-    x2 = foll_sample[0]
-    y2 = foll_sample[1]
-    x_step = (x2-x1)/(counter+1)
-    y_step = (y2-y1)/(counter+1)
-    fill_x = [x1+c*x_step for c in range(1,counter+1)]
-    fill_y = [y1+c*y_step for c in range(1,counter+1)]
+    layout = aoi_layout(aoi, aoi_ag)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.asarray(valid, dtype=bool) & np.isfinite(x) & np.isfinite(y)
 
-    fill_values = list((zip(fill_x, fill_y)))
+    tables = _aoi_lookup_tables(layout)
+    if tables is None:
+        return _aoi_tag_codes_broadcast(x, y, valid, layout)
 
-    return fill_values
+    x_masks, y_masks, priority = tables
+    aoi_masks = x_masks[_lookup_cells(x, valid, x_masks.size)] & y_masks[_lookup_cells(y, valid, y_masks.size)]
 
+    return priority[aoi_masks]
 
-def assign_aoi_tags(df, aoi, aoi_ag=None):
+
+def aoi_layout(aoi, aoi_ag=None):
     """
-    Adds "aoi" column containing an aoi tag for each gazepoint.
-    ----------
-    aoi: collections.namedtuple
+    Returns the AOIs of the layout in priority order as a hashable tuple of
+    (left, right, top, bottom, tag code) rows.
     """
 
-    def gazepoint_to_aoi(gazepoint, aoi, aoi_ag=None):
-        """ Checks if the gazepoint is within an AOI and returns the aoi label or the gazepoint."""
+    tagged_aois = [(aoi.inter, "INT"), (aoi.bor, "BOR"), (aoi_ag, "ATT"), (aoi.fam1, "FAM"), (aoi.fam2, "FAM")]
 
-        def contains(gazepoint, AOI):
-            """ Checks if a pair of coordinates is within an AOI. """
+    return tuple((AOI[0][0] - AOI[1]/2, AOI[0][0] + AOI[1]/2, AOI[0][1] - AOI[2]/2, AOI[0][1] + AOI[2]/2,
+                  AOI_TAGS.index(tag))
+                 for AOI, tag in tagged_aois if AOI)
 
-            if gazepoint == "invalid":
-                return False
 
-            gpx, gpy = gazepoint[0], gazepoint[1]
-            aoix, aoiy = AOI[0][0], AOI[0][1]
-            width, height = AOI[1], AOI[2]
+@functools.lru_cache(maxsize=None)
+def _aoi_lookup_tables(layout):
+    """
+    Precompiles the lookup tables of an AOI layout (built once per layout and process).
 
-            if ((aoix - width/2) <= gpx <= (aoix + width/2) and (aoiy - height/2) <= gpy <= (aoiy + height/2)):
-                return True
-            else:
-                return False
+    The screen is cut into cells along each axis: one cell for each integer coordinate
+    and one for each open interval between them (plus one cell before and one after the screen),
+    so every AOI border falls on a cell and a cell is either fully in or fully out of an AOI.
+        x_masks, y_masks: uint8 bitmask of the AOIs covering the cell
+        priority: tag code of the highest priority AOI for each bitmask
+    Tagging a gazepoint is then an index into each table, whatever the nr of AOIs.
 
+    Returns None if the layout can't be rasterized (non-integer borders, AOI off-screen, > 8 AOIs).
+    """
 
-        if contains(gazepoint, aoi.inter):
-            return "INT"
-        elif contains(gazepoint, aoi.bor):
-            return "BOR"
-        elif aoi_ag and contains(gazepoint, aoi_ag):
-            return "ATT"
-        elif aoi.fam1 and contains(gazepoint, aoi.fam1):
-            return "FAM"
-        elif aoi.fam2 and contains(gazepoint, aoi.fam2):
-            return "FAM"
-        else:
-            return "OUT"
+    borders = np.array([row[:4] for row in layout], dtype=np.float64)
+    if (len(layout) > 8 or (borders != np.round(borders)).any() or (borders < 0).any()):
+        return None
 
+    width = int(max(DS[0], borders[:, 1].max()))
+    height = int(max(DS[1], borders[:, 3].max()))
 
-    # add "aoi" columns with aoi tags
-    df = df.assign(aoi = df["gazepoints"]
-            .swifter.progress_bar(False).apply(gazepoint_to_aoi, args=(aoi,), aoi_ag=aoi_ag).values)
+    x_masks = np.zeros(2*width + 3, dtype=np.uint8)
+    y_masks = np.zeros(2*height + 3, dtype=np.uint8)
+    for bit, (left, right, top, bottom, code) in enumerate(layout):
+        x_masks[2*int(left)+1 : 2*int(right)+2] |= np.uint8(1 << bit)
+        y_masks[2*int(top)+1 : 2*int(bottom)+2] |= np.uint8(1 << bit)
 
-    return df
+    codes = np.array([row[4] for row in layout], dtype=np.int8)
+    priority = np.full(256, AOI_TAGS.index("OUT"), dtype=np.int8)
+    for aoi_mask in range(1, 1 << len(layout)):
+        lowest_bit = (aoi_mask & -aoi_mask).bit_length() - 1
+        priority[aoi_mask] = codes[lowest_bit]
+
+    return x_masks, y_masks, priority
+
+
+def _lookup_cells(coords, valid, nr_of_cells):
+    """ Returns the lookup table cell of each coordinate (see _aoi_lookup_tables)."""
+
+    coords = np.where(valid, coords, -1.0)
+    floor = np.floor(coords)
+    cells = 2*floor + (coords != floor) + 1
+
+    return np.clip(cells, 0, nr_of_cells - 1).astype(np.intp)
+
+
+def _aoi_tag_codes_broadcast(x, y, valid, layout):
+    """ Tags gazepoints with broadcasted rectangle tests (for layouts without lookup tables)."""
+
+    borders = np.array([row[:4] for row in layout], dtype=np.float64)
+    aoi_codes = np.array([row[4] for row in layout], dtype=np.int8)
+
+    x, y = x[:, None], y[:, None]
+    hits = ((borders[:, 0] <= x) & (x <= borders[:, 1]) & (borders[:, 2] <= y) & (y <= borders[:, 3])
+            & valid[:, None])
+
+    # first aoi hit in priority order
+    codes = np.where(hits.any(axis=1), aoi_codes[hits.argmax(axis=1)], AOI_TAGS.index("OUT"))
+
+    return codes.astype(np.int8)
 
 
 # TODO
@@ -186,41 +342,15 @@ def calculate_velocity(df):
     Velocity is not calculated at events and in "invalid" datapoints.
     df: dataframe of all subject data without events, with successive indices
     """
-    s = df["gazepoints"]
-
-    velocity_values =  pd.Series(data=[np.nan]*len(s.index), index=s.index)
-    velocity_values[0] = 0
-
-    for i in s.index[:-1]:
-
-        gazepoint = s[i]
-
-        if gazepoint == "invalid":
-            velocity_values[i+1] = "None"
-
-        else :
-            x1 = gazepoint[0]
-            y1 = gazepoint[1]
-
-            k = i+1
-            next_gazepoint = s[k]
+    x = df["x"].to_numpy(dtype=np.float64)
+    y = df["y"].to_numpy(dtype=np.float64)
+    valid = df["valid"].to_numpy()
 
-            if next_gazepoint == "invalid": # no velo
-                velocity_values[k] = "None"
-
-            else:
-                x2 = next_gazepoint[0]
-                y2 = next_gazepoint[1]
-
-                dist = math.sqrt((x2-x1)**2 + (y2-y1)**2)
-
-                velo = dist / 16.7
-                velocity_values[k] = velo
+    velocity_values = np.empty(len(x), dtype=object)
+    if len(x):
+        velocity_values[0] = 0
+        velocity_values[1:] = np.sqrt(np.diff(x)**2 + np.diff(y)**2) / 16.7
+        velocity_values[1:][~(valid[:-1] & valid[1:])] = "None"
 
     df = df.assign(velocity = velocity_values)
     return df
-
-
-
-
-
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Stored per-subject results for incremental runs (see RunConfig.incremental).
+
+The store directory holds the pickled result of main_data_parser.process_logfile for each logfile
+and a manifest.json with the size and modification time of the logfiles they were computed from.
+Only new or changed logfiles have to be processed again; delete the directory to recompute everything
+(e.g. after changing the parsing code).
+"""
+
+import json
+import os
+import pickle
+
+
+STORE_VERSION = 2
+
+
+class ResultsStore:
+
+    def __init__(self, store_dir):
+        """
+        store_dir: directory of the manifest and the result files
+        """
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._manifest_path = os.path.join(store_dir, "manifest.json")
+        self.manifest = self._read_manifest() # {logfile name: {"size", "mtime_ns", "result"}}
+
+
+    def is_current(self, log, logfilepath):
+        """ Checks if there is a stored result computed from the current version of the logfile. """
+
+        entry = self.manifest.get(log)
+        if entry is None or not os.path.isfile(os.path.join(self.store_dir, entry["result"])):
+            return False
+
+        stat = os.stat(logfilepath)
+        return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+
+    def save(self, log, logfilepath, result):
+        """ Stores the result of a logfile (the manifest is written by write_manifest). """
+
+        result_file = os.path.splitext(log)[0] + ".pkl"
+        with open(os.path.join(self.store_dir, result_file), "wb") as f:
+            pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+
+        stat = os.stat(logfilepath)
+        self.manifest[log] = dict(size=stat.st_size, mtime_ns=stat.st_mtime_ns, result=result_file)
+
+
+    def load(self, log):
+
+        with open(os.path.join(self.store_dir, self.manifest[log]["result"]), "rb") as f:
+            return pickle.load(f)
+
+
+    def prune(self, logs):
+        """ Removes the results of logfiles that are not in logs anymore. """
+
+        for log in set(self.manifest) - set(logs):
+            entry = self.manifest.pop(log)
+            try:
+                os.remove(os.path.join(self.store_dir, entry["result"]))
+            except FileNotFoundError:
+                pass
+
+
+    def write_manifest(self):
+
+        tmp = self._manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(dict(version=STORE_VERSION, logfiles=self.manifest), f, indent=1, sort_keys=True)
+        os.replace(tmp, self._manifest_path)
+
+
+    def _read_manifest(self):
+
+        try:
+            with open(self._manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return manifest["logfiles"] if manifest.get("version") == STORE_VERSION else {}
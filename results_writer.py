@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Output of the subject tables (see main_data_parser._parse_logfiles).
+
+The tables of all subjects are buffered and written in one pass on close:
+    xlsx: one sheet per subject, the tables below each other (as before).
+          Written by xlsxwriter if it is installed.
+    csv, parquet: one long table per table name (intro, teaching, test, gaze)
+          with a subj_nr column, in a directory named as the excel file would be.
+"""
+
+import os
+import pandas as pd
+
+
+OUTPUT_FORMATS = ("xlsx", "csv", "parquet")
+DECIMALS = 3
+
+
+def round_numbers(df, decimals=DECIMALS):
+    """
+    Rounds the float values of df to decimals with python's round, as the original per cell rounding
+    (DataFrame.round rounds some half-way values differently, e.g. 0.1235, 2.6745, 0.0005).
+    The subject frames are small, so it is done column by column on a copy.
+    """
+
+    df = df.copy()
+    for i in range(df.shape[1]):
+        df.isetitem(i, df.iloc[:, i].map(lambda x: _round_number(x, decimals)))
+
+    return df
+
+
+def _round_number(x, decimals):
+
+    if isinstance(x, (float, complex)):
+        return round(float(x), decimals)
+    else:
+        return x
+
+
+class ResultsWriter:
+
+    def __init__(self, path, output_format="xlsx"):
+        """
+        path: excel file; for csv and parquet the directory is path without the extension
+        output_format: "xlsx", "csv" or "parquet"
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format should be one of {OUTPUT_FORMATS}, got {output_format!r}")
+
+        if output_format == "parquet":
+            # fail before the logfiles are processed, not when the tables are written
+            _check_parquet_engine()
+
+        self.output_format = output_format
+        self.path = path if output_format == "xlsx" else os.path.splitext(path)[0]
+        self._sheets = {} # {subj_nr: [(name, df, index, startrow)]}
+
+
+    def add(self, subj_nr, name, df, index=False, startrow=0):
+        """ Buffers a table of a subject (rounded when written). """
+
+        self._sheets.setdefault(subj_nr, []).append((name, df, index, startrow))
+
+
+    def close(self):
+        """ Writes the buffered tables. """
+
+        if self.output_format == "xlsx":
+            self._write_xlsx()
+        else:
+            self._write_tables()
+        self._sheets = {}
+
+
+    def _write_xlsx(self):
+
+        # xlsxwriter is faster, if it is installed.
+        # (not in constant_memory mode: it only keeps the current row, but to_excel writes column by column)
+        try:
+            writer = pd.ExcelWriter(self.path, engine="xlsxwriter")
+        except ImportError:
+            writer = pd.ExcelWriter(self.path)
+
+        with writer:
+            for subj_nr, blocks in self._sheets.items():
+                for _, df, index, startrow in blocks:
+                    round_numbers(df).to_excel(writer, sheet_name=subj_nr, index=index, startrow=startrow)
+
+
+    def _write_tables(self):
+
+        tables = {}
+        for subj_nr, blocks in self._sheets.items():
+            for name, df, index, _ in blocks:
+                df = df.copy()
+                df.columns = [" ".join(col) if isinstance(col, tuple) else col for col in df.columns.to_flat_index()]
+                if index:
+                    df = df.rename_axis("trial").reset_index()
+                df.insert(0, "subj_nr", subj_nr)
+                tables.setdefault(name, []).append(df)
+
+        os.makedirs(self.path, exist_ok=True)
+        for name, dfs in tables.items():
+            df = round_numbers(pd.concat(dfs, ignore_index=True))
+            path = os.path.join(self.path, f"{name}.{self.output_format}")
+            if self.output_format == "csv":
+                df.to_csv(path, index=False)
+            else:
+                df.to_parquet(path, index=False)
+
+
+def _check_parquet_engine():
+
+    for engine in ("pyarrow", "fastparquet"):
+        try:
+            __import__(engine)
+            return
+        except ImportError:
+            pass
+
+    raise ImportError("parquet output needs pyarrow or fastparquet")
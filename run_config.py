@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Settings and output paths of a pipeline run (see main_data_parser.run_pipeline)
+"""
+
+import datetime
+import hashlib
+import os
+
+from constants import DIR
+import time_course_store
+
+
+class RunConfig:
+
+    def __init__(self, test=False, save_to_file=True, do_aggregation=True, analyse_tc=False,
+                 save_tc=True, fulltime=False, workers=1, use_cache=True, incremental=False,
+                 chunksize=None, output_format="xlsx", permutations=10000, bootstrap=0, trace_memory=False,
+                 base_dir=DIR, logfilespath=None, date=None):
+        """
+        test: read the test data directory and write to the test prints directory
+        save_to_file: write the subject sheets excel file
+        do_aggregation: aggregate the subject results (looking_time_aggregations)
+        analyse_tc: time course analysis and plots (time_course_plotting)
+        save_tc: save the time course dict in the time course store (see time_course_store)
+        fulltime: test period. full time or up to start_time + 2000ms
+        workers: nr of processes to parse the logfiles in parallel
+        use_cache: keep the parsed and interpolated sessions in cache_dir (see session_cache)
+        incremental: only process new or changed logfiles, reuse the results in results_dir (see results_store)
+        chunksize: read the logfiles in chunks of this many rows (rt.read_tsv_file_chunked), None: in one go
+        output_format: format of the subject tables, "xlsx", "csv" or "parquet" (see results_writer)
+        permutations: nr of permutations of the cluster test of the time course (see cluster_permutation), 0: no test
+        bootstrap: nr of resamples of the bootstrap confidence bands of the time course (see bootstrap_bands),
+            0: SE bands
+        trace_memory: record the peak traced memory of each stage in the run report (see instrumentation),
+            slows the run down
+        base_dir: directory of the input and output directories
+        logfilespath: directory of the logfiles, default: base_dir/data_to_read(_TEST)
+        date: date string used in output names, default: today
+        """
+        self.test = test
+        self.save_to_file = save_to_file
+        self.do_aggregation = do_aggregation
+        self.analyse_tc = analyse_tc
+        self.save_tc = save_tc
+        self.fulltime = fulltime
+        self.workers = workers
+        self.use_cache = use_cache
+        self.incremental = incremental
+        self.chunksize = chunksize
+        self.output_format = output_format
+        self.permutations = permutations
+        self.bootstrap = bootstrap
+        self.trace_memory = trace_memory
+        self.base_dir = base_dir
+        self._logfilespath = logfilespath
+        self.date = date or str(datetime.date.today())
+
+
+    @property
+    def timing(self):
+        return "4sec_test" if self.fulltime else "2sec_test"
+
+    @property
+    def logfilespath(self):
+        if self._logfilespath:
+            return self._logfilespath
+        return os.path.join(self.base_dir, "data_to_read_TEST" if self.test else "data_to_read")
+
+    @property
+    def dir_name(self):
+        return os.path.join(self.base_dir, "tables", self.date)
+
+    @property
+    def test_dir_name(self):
+        return os.path.join(self.base_dir, "tables", "test_prints", self.date)
+
+    @property
+    def excelfile(self):
+        if self.test:
+            return os.path.join(self.test_dir_name, f"curiosity_looking_data_TEST_{self.timing}_{self.date}.xlsx")
+        return os.path.join(self.dir_name, f"curiosity_looking_data_{self.timing}_{self.date}.xlsx")
+
+    @property
+    def tc_store_path(self):
+        return time_course_store.run_path(self.timing, self.date, self.base_dir)
+
+    @property
+    def plots_dir(self):
+        return os.path.join(self.base_dir, "time_course", "plots", self.date)
+
+    @property
+    def tc_tables_dir(self):
+        return os.path.join(self.base_dir, "time_course", "tables", self.date)
+
+    @property
+    def cache_dir(self):
+        return os.path.join(self.base_dir, "cache", "sessions")
+
+    @property
+    def results_dir(self):
+        # results depend on the input directory and the test period:
+        # a store per logfiles directory (name and short hash of its path), so cohorts don't prune each other
+        logfilespath = os.path.abspath(self.logfilespath)
+        digest = hashlib.sha1(logfilespath.encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.base_dir, "results", ("TEST_" if self.test else "") + self.timing,
+                            f"{os.path.basename(logfilespath)}_{digest}")
+
+    @property
+    def runlogs_dir(self):
+        return os.path.join(self.base_dir, "runlogs")
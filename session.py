@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Gaze data of one subject's session, with the aoi tags of each layout computed once.
+"""
+
+import numpy as np
+import pandas as pd
+
+import instrumentation as instr
+import reading_and_transformations as rt
+from constants import AOI_TAGS
+
+
+class Session:
+    """
+    Wraps the (interpolated) gaze dataframe of a session.
+
+    The aoi tags of a layout are computed for the whole session the first time the layout
+    is asked for, every window tagged with that layout is then a slice of the same tag array.
+    """
+
+    def __init__(self, df):
+        """
+        df: gaze dataframe (TimeStamp, x, y, valid columns), without events
+        """
+        self.df = df
+        self.timestamps = df["TimeStamp"].to_numpy()
+        self._tagged = {} # {layout: dataframe with TimeStamp and aoi columns}
+        # nr of valid samples before each position
+        self._valid_cumsum = np.concatenate(([0], np.cumsum(df["valid"].to_numpy(), dtype=np.int64)))
+
+        if (np.diff(self.timestamps) < 0).any() or np.isnan(self.timestamps).any():
+            raise ValueError("TimeStamp column of the session is not sorted.")
+
+
+    def window(self, start, end, include_start=False, include_end=False, aoi=None, aoi_ag=None):
+        """
+        Returns the samples between start and end as a slice (no copy) of the session dataframe,
+        or of the tagged dataframe of the layout if aoi is given.
+        By default both ends are excluded: start < TimeStamp < end.
+        """
+
+        lo, hi = self.window_bounds(start, end, include_start=include_start, include_end=include_end)
+        df = self.df if aoi is None else self.tagged(aoi, aoi_ag=aoi_ag)
+
+        return df.iloc[int(lo):int(hi)]
+
+
+    def window_bounds(self, start_times, end_times, include_start=False, include_end=False):
+        """
+        Binary search on the sorted timestamps;
+        returns the first and last+1 positions of the window(s) (scalars or arrays).
+        """
+
+        lo = np.searchsorted(self.timestamps, start_times, side="left" if include_start else "right")
+        hi = np.searchsorted(self.timestamps, end_times, side="right" if include_end else "left")
+
+        return lo, np.maximum(hi, lo)
+
+
+    def onscreen_proportions(self, start_times, end_times):
+        """
+        Returns the proportion of valid (on screen) samples in each start <= TimeStamp < end window,
+        nan for empty windows.
+        """
+
+        lo, hi = self.window_bounds(np.asarray(start_times, dtype=np.float64), np.asarray(end_times, dtype=np.float64),
+                                    include_start=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return (self._valid_cumsum[hi] - self._valid_cumsum[lo]) / (hi - lo)
+
+
+    def tagged(self, aoi, aoi_ag=None):
+        """
+        Returns a dataframe of the whole session with "TimeStamp" and "aoi" columns
+        for the given layout (see rt.assign_aoi_tags).
+        """
+
+        layout = rt.aoi_layout(aoi, aoi_ag)
+        if layout not in self._tagged:
+            with instr.stage("aoi_tagging", samples=len(self.df)):
+                codes = rt.aoi_tag_codes(self.df["x"].to_numpy(), self.df["y"].to_numpy(),
+                                         self.df["valid"].to_numpy(), aoi, aoi_ag=aoi_ag)
+            self._tagged[layout] = pd.DataFrame({"TimeStamp": self.df["TimeStamp"].to_numpy(),
+                                                 "aoi": pd.Categorical.from_codes(codes, categories=AOI_TAGS)},
+                                                index=self.df.index)
+
+        return self._tagged[layout]
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of the parsed sessions: the events and the interpolated gaze data of a logfile
+(result of rt.read_tsv_file + rt.detach_events + rt.interpolate_missing_samples).
+
+Each entry is an uncompressed .npz file (one array per column) and a small .json file with
+the size, modification time and sha1 hash of the source logfile.
+The cache key contains the path of the logfile and the interpolation parameters,
+an entry is recomputed if the logfile changed.
+"""
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+import instrumentation as instr
+import reading_and_transformations as rt
+
+
+CACHE_VERSION = 1
+
+
+def read_session(logfilepath, cache_dir=None, freq=60, max_gap_length=101, chunksize=None):
+    """
+    Returns the events dataframe and the interpolated gaze dataframe of the logfile,
+    from the cache if possible (None, None if the file is compromised).
+    cache_dir: None: no caching
+    chunksize: read the logfile in chunks of chunksize rows (rt.read_tsv_file_chunked)
+    """
+
+    if cache_dir is None:
+        return _parse_session(logfilepath, freq, max_gap_length, chunksize)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    params = dict(freq=freq, max_gap_length=max_gap_length)
+    entry = os.path.join(cache_dir, _entry_name(logfilepath, params))
+
+    stat = os.stat(logfilepath)
+    meta = _read_meta(entry + ".json")
+    if meta is not None and meta["params"] == params and meta["size"] == stat.st_size:
+
+        if meta["mtime_ns"] != stat.st_mtime_ns:
+            # touched: same file if the content is the same
+            if meta["sha1"] != _file_hash(logfilepath):
+                meta = None
+            else:
+                meta["mtime_ns"] = stat.st_mtime_ns
+                _write_json(entry + ".json", meta)
+
+        if meta is not None and os.path.isfile(entry + ".npz"):
+            with instr.stage("cache_load") as st:
+                df_events, df = _load_entry(entry + ".npz")
+                st["samples"] = len(df)
+            return df_events, df
+
+    df_events, df = _parse_session(logfilepath, freq, max_gap_length, chunksize)
+    if df is not None:
+        with instr.stage("cache_save", samples=len(df)):
+            _save_entry(entry + ".npz", df_events, df)
+        _write_json(entry + ".json", dict(version=CACHE_VERSION, source=os.path.abspath(logfilepath),
+                                          size=stat.st_size, mtime_ns=stat.st_mtime_ns,
+                                          sha1=_file_hash(logfilepath), params=params))
+
+    return df_events, df
+
+
+def _parse_session(logfilepath, freq, max_gap_length, chunksize=None):
+
+    if chunksize:
+        with instr.stage("read") as st:
+            df_events, df = rt.read_tsv_file_chunked(logfilepath, chunksize=chunksize)
+            st["samples"] = len(df) if df is not None else 0
+        if df is None:
+            return None, None
+    else:
+        with instr.stage("read") as st:
+            df = rt.read_tsv_file(logfilepath)
+            st["samples"] = len(df) if df is not None else 0
+        if df is None:
+            return None, None
+        with instr.stage("detach_events", samples=len(df)):
+            df_events, df = rt.detach_events(df)
+
+    with instr.stage("interpolate") as st:
+        df = rt.interpolate_missing_samples(df, freq=freq, max_gap_length=max_gap_length)
+        st["samples"] = len(df)
+
+    return df_events, df
+
+
+def _entry_name(logfilepath, params):
+
+    key = json.dumps([CACHE_VERSION, os.path.abspath(logfilepath), params], sort_keys=True)
+    stem = os.path.splitext(os.path.basename(logfilepath))[0]
+
+    return f"{stem}_{hashlib.sha1(key.encode()).hexdigest()[:12]}"
+
+
+def _file_hash(path):
+
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+def _read_meta(path):
+
+    try:
+        with open(path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return meta if meta.get("version") == CACHE_VERSION else None
+
+
+def _write_json(path, d):
+
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(d, f)
+    os.replace(tmp, path)
+
+
+def _save_entry(path, df_events, df):
+
+    tmp = path + ".tmp.npz"
+    np.savez(tmp,
+             event_index=df_events.index.to_numpy(),
+             event_timestamp=df_events["TimeStamp"].to_numpy(),
+             event=np.array(df_events["Event"].astype(str).tolist(), dtype=str),
+             timestamp=df["TimeStamp"].to_numpy(),
+             x=df["x"].to_numpy(),
+             y=df["y"].to_numpy(),
+             valid=df["valid"].to_numpy(),
+             original_index=df["original_index"].to_numpy())
+    os.replace(tmp, path)
+
+
+def _load_entry(path):
+
+    with np.load(path) as arrays:
+        df_events = pd.DataFrame({"TimeStamp": arrays["event_timestamp"],
+                                  "Event": arrays["event"].astype(object)},
+                                 index=arrays["event_index"])
+        df = pd.DataFrame({"TimeStamp": arrays["timestamp"],
+                           "x": arrays["x"],
+                           "y": arrays["y"],
+                           "valid": arrays["valid"],
+                           "original_index": arrays["original_index"]},
+                          index=pd.RangeIndex(len(arrays["timestamp"]), name="new_index"))
+
+    return df_events, df
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic Tobii T60XL exports for testing and benchmarking the pipeline without participant data.
+
+A session has the event sequence documented in constants.py (old log format before 2020-02-24,
+new format after) and 60 Hz gaze samples: fixations on the objects shown in each phase,
+on the attention getter before the tests, elsewhere on the screen, or off the screen,
+with short track loss bursts in between. Every baseline has a look on the interesting and on the boring
+object, as the target look of the time course is relative to them.
+
+usage:
+    python synthetic_sessions.py data_to_read_TEST --subjects 240
+    python synthetic_sessions.py data_to_read_TEST --subjects 24 --old 0.5 --track-loss 0.2 --duration 3600
+"""
+
+import argparse
+import datetime
+import os
+import numpy as np
+import pandas as pd
+
+import constants as c
+
+
+# fixation targets
+TARGETS = ["left", "right", "top-left", "bottom-left", "top-right", "bottom-right", "center", "screen", "off"]
+_CENTERS = {"left": c.AOI_left[0], "right": c.AOI_right[0],
+            "top-left": c.top_left, "bottom-left": c.bottom_left,
+            "top-right": c.top_right, "bottom-right": c.bottom_right,
+            "center": c.AOI_ag[0]}
+
+LABELS = ["tacok", "bitye"]
+FAM_OBJECTS = ["banana", "apple"]
+FEB24 = datetime.date(2020, 2, 24)
+BASELINE_LOOK = 30 # nr of samples of the looks on the interesting and the boring object in every baseline
+
+
+def generate_events(oldlog=False, seed=None):
+    """
+    Returns the event list [(time in ms, event)] of a completed session
+    with random interesting sides (see constants.py for the sequence).
+    """
+
+    rng = np.random.default_rng(seed)
+    events = []
+    t = 1000
+
+    def log(event, dt):
+        nonlocal t
+        t += dt
+        events.append((t, event))
+
+    # introduction: familiar objects
+    for _ in range(2):
+        log("intro_with_face_start", 500)
+        log(c.FAM_DEMO, 3000)
+        log(c.FAM_LBL_START, c.fam_demo_dur + 500)
+        log("labeling_fam_occluders_up", 1000)
+        log(c.FAM_LBL_END, 2000)
+
+    # teaching: the animation starts 3000 ms after the "intro_with_face_start"
+    teaching_sides = rng.permutation(["left", "left", "right", "right"])
+    for n, side in enumerate(teaching_sides):
+        anim_event = f"Familiarisation_anim{n+1}_{side}{n%2+1}"
+        if oldlog: # logged at the start of the animation, before the face
+            log(anim_event, 3500)
+            log("intro_with_face_start", 10)
+            log("occluders_going_down", c.anim_dur + 100)
+        else:
+            log("intro_with_face_start", 500)
+            log(anim_event, 10)
+            log("occluders_going_down", 3000 + c.anim_dur + 100)
+        log("shuffle_starts", 1000)
+        log(c.TEACH_LBL_START, 2000)
+        log(c.TEACH_LBL_END, 2500)
+
+    # test: interesting label first, then the other label on the other diagonal
+    first_side = str(rng.choice(list(c.AOI_dict)))
+    test_sides = [first_side, c.second_int_side_dict[first_side]]
+    labels = rng.permutation(LABELS)
+    fams = rng.permutation(FAM_OBJECTS)
+    for n, (kind, side) in enumerate(zip(["int", "other"], test_sides)):
+        log("lifting_occluders", 1000)
+        log(c.BASELINE_EVENT, 1000)
+        log(c.ATT_GETT_START, 3000)
+        if oldlog:
+            log(f"test__{kind}_label_{side.replace('-', '_')}_{labels[n]}_STARTS", 2672)
+            log(f"test__{kind}_label_ENDS", 4000)
+        else:
+            fam_side = _aoi_sides(side)[2].replace("-", "_")
+            log(f"test__{kind}Label:{labels[n]}:{side}_{fams[n]}:{fam_side}_STARTS", 2672)
+            log(f"test__{kind}Label_ENDS", 4000)
+
+    log(c.EXP_COMPLETED, 1000)
+
+    return events
+
+
+def generate_session(oldlog=False, track_loss=0.1, loss_burst=8, offscreen=0.05, interest=0.6, ag_look=0.9,
+                     fixation_samples=(10, 90), spread=60, duration=None, completed=True, seed=None):
+    """
+    Returns a dataframe like a Tobii export: TimeStamp, Event, GazePointX, GazePointY.
+    --------------
+    parameters:
+        oldlog: log format before 2020-02-24
+        track_loss: proportion of samples lost in short bursts (GazePoint -1,-1)
+        loss_burst: max nr of samples of a track loss burst
+        offscreen: proportion of fixations off the screen (lost)
+        interest: proportion of object fixations on the interesting object (teaching and test)
+        ag_look: probability of fixating the attention getter before a test
+        fixation_samples: range of the nr of samples of a fixation
+        spread: sd of the gaze points around the fixated point (px)
+        duration: recording length in seconds (at least the length of the experiment + 2 s)
+        completed: log "Experiment_ended"
+        seed: random seed
+    """
+
+    rng = np.random.default_rng(seed)
+
+    events = generate_events(oldlog, seed=rng.integers(2**32))
+    if not completed:
+        events = events[:-1]
+    end_time = events[-1][0] + 2000
+    if duration is not None:
+        end_time = max(end_time, duration * 1000)
+
+    n = int(end_time / c.ST)
+    # float timestamps and gaze points, as in the exports (read_tsv_file rejects integer columns)
+    timestamps = np.round(np.arange(n) * c.ST, 1)
+
+    phase_weights, phase, baselines = _gaze_phases(events, timestamps, oldlog, offscreen, interest, ag_look)
+
+    # fixations: random length, target drawn from the weights of the phase at its start
+    lo, hi = fixation_samples
+    lengths = rng.integers(lo, hi + 1, size=n // lo + 1)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    starts = starts[starts < n]
+    lengths = lengths[:len(starts)]
+    fix_phase = phase[starts]
+    fix_target = np.empty(len(starts), dtype=np.int64)
+    for p, weights in enumerate(phase_weights):
+        mask = fix_phase == p
+        fix_target[mask] = rng.choice(len(TARGETS), size=mask.sum(), p=weights)
+
+    centers = np.array([_CENTERS.get(target, (np.nan, np.nan)) for target in TARGETS])
+    fix_x, fix_y = centers[fix_target, 0], centers[fix_target, 1]
+    on_screen = TARGETS.index("screen")
+    fix_x[fix_target == on_screen] = rng.uniform(0, c.X, (fix_target == on_screen).sum())
+    fix_y[fix_target == on_screen] = rng.uniform(0, c.Y, (fix_target == on_screen).sum())
+
+    fix_id = np.repeat(np.arange(len(starts)), lengths)[:n]
+    x = np.clip(np.round(fix_x[fix_id] + rng.normal(0, spread, n)), 0, c.X - 1)
+    y = np.clip(np.round(fix_y[fix_id] + rng.normal(0, spread, n)), 0, c.Y - 1)
+
+    # off screen fixations and track loss bursts
+    lost = fix_target[fix_id] == TARGETS.index("off")
+    if track_loss > 0:
+        bursts = rng.integers(0, n, int(n * track_loss / ((1 + loss_burst) / 2)))
+        burst_lengths = rng.integers(1, loss_burst + 1, len(bursts))
+        loss = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(loss, bursts, 1)
+        np.add.at(loss, np.minimum(bursts + burst_lengths, n), -1)
+        lost |= np.cumsum(loss[:-1]) > 0
+
+    # looks on the interesting object in the first half of the baselines, on the boring object in the second half
+    for start, end, sides in baselines:
+        first, last = np.searchsorted(timestamps, start, side="right"), np.searchsorted(timestamps, end)
+        half = (last - first) // 2
+        if half < BASELINE_LOOK:
+            continue
+        for k, side in enumerate(sides):
+            look_start = first + k * half + rng.integers(half - BASELINE_LOOK + 1)
+            look = slice(look_start, look_start + BASELINE_LOOK)
+            x[look] = np.clip(np.round(_CENTERS[side][0] + rng.normal(0, spread, BASELINE_LOOK)), 0, c.X - 1)
+            y[look] = np.clip(np.round(_CENTERS[side][1] + rng.normal(0, spread, BASELINE_LOOK)), 0, c.Y - 1)
+            lost[look] = False
+    x[lost], y[lost] = -1, -1
+
+    gaze = pd.DataFrame({"TimeStamp": timestamps,
+                         "Event": None,
+                         "GazePointX": x,
+                         "GazePointY": y})
+    event_rows = pd.DataFrame({"TimeStamp": np.array([t for t, _ in events], dtype=np.float64),
+                               "Event": [e for _, e in events],
+                               "GazePointX": np.nan,
+                               "GazePointY": np.nan})
+
+    return pd.concat([gaze, event_rows], ignore_index=True).sort_values("TimeStamp", kind="stable")
+
+
+def _gaze_phases(events, timestamps, oldlog, offscreen, interest, ag_look):
+    """
+    Returns the target weights of each phase, the phase of each sample
+    and the baselines as [(start, end, (interesting side, boring side))].
+    The phase windows are read back from the events with the classes of constants.py.
+    """
+
+    df_events = pd.DataFrame(events, columns=["TimeStamp", "Event"])
+
+    def weights(**targets):
+        w = np.zeros(len(TARGETS))
+        for target, weight in targets.items():
+            w[TARGETS.index(target.replace("_", "-"))] = weight
+        w[TARGETS.index("off")] = offscreen
+        return w / w.sum()
+
+    phase_weights = [weights(screen=0.5, left=0.25, right=0.25)] # between the phases
+    windows = []
+
+    def add_phase(start, end, w):
+        phase_weights.append(w)
+        windows.append((start, end, len(phase_weights) - 1))
+
+    fam = c.Fam_data(df_events)
+    for start, end in zip(fam.start_times + fam.label_start_times, fam.end_times + fam.label_end_times):
+        add_phase(start, end, weights(left=0.45, right=0.45, screen=0.1))
+
+    baselines = []
+    if c.EXP_COMPLETED not in df_events["Event"].tolist():
+        return phase_weights, _phase_of_samples(timestamps, windows), baselines
+
+    teaching = c.Teaching_data(df_events, oldlog)
+    for start, end, side in zip(teaching.start_times, teaching.end_times, teaching.interesting_sides):
+        other = "right" if side == "left" else "left"
+        add_phase(start, end, weights(**{side: 0.9 * interest, other: 0.9 * (1 - interest), "screen": 0.1}))
+
+    test = c.Test_controll_data(df_events, oldlog)
+    for n, side in enumerate(test.interesting_sides):
+        inter, bor, fam1, fam2 = _aoi_sides(side)
+        add_phase(test.bl_start_times[n], test.ag_start_times[n],
+                  weights(**{inter: 0.25, bor: 0.25, fam1: 0.2, fam2: 0.2, "screen": 0.1}))
+        baselines.append((test.bl_start_times[n], test.ag_start_times[n], (inter, bor)))
+        # attention getter up to the test start, the test window starts 339 ms earlier (see parse_test_data)
+        add_phase(test.ag_start_times[n], test.start_times[n] + c.ER,
+                  weights(center=ag_look, screen=1 - ag_look))
+        add_phase(test.start_times[n] + c.ER, test.end_times[n],
+                  weights(**{inter: 0.8 * interest, bor: 0.8 * (1 - interest), fam1: 0.1, fam2: 0.1}))
+
+    return phase_weights, _phase_of_samples(timestamps, windows), baselines
+
+
+def _aoi_sides(int_side):
+    """ Returns the sides of the interesting, boring and familiar objects (see constants.AOI_dict). """
+
+    return [[s for s in c.AOI_dict if c.AOI_dict[s][0] is aoi][0] for aoi in c.AOI_dict[int_side]]
+
+
+def _phase_of_samples(timestamps, windows):
+
+    phase = np.zeros(len(timestamps), dtype=np.int64)
+    for start, end, p in windows:
+        phase[np.searchsorted(timestamps, start):np.searchsorted(timestamps, end, side="right")] = p
+
+    return phase
+
+
+def write_session(path, **kwargs):
+    """ Writes a generated session (see generate_session for the parameters) as a Tobii tsv export. """
+
+    generate_session(**kwargs).to_csv(path, sep="\t", index=False)
+
+
+def write_cohort(directory, subjects=24, old=0.0, start_date=datetime.date(2020, 3, 2), seed=0, **kwargs):
+    """
+    Writes the sessions of a cohort to directory, one subject a day from start_date.
+    The first old*subjects subjects have the old log format, dated between 2020-01-06 and 2020-02-23.
+    Filenames are like the exports: S001_curiosity_v5_2020-03-02_10-00.tsv
+    kwargs: parameters of generate_session
+    Returns the paths of the files.
+    """
+
+    if start_date < FEB24:
+        raise ValueError(f"start_date of the new log format should be from {FEB24}")
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    n_old = int(round(subjects * old))
+    old_date = datetime.date(2020, 1, 6)
+    old_days = (FEB24 - old_date).days
+    width = max(3, len(str(subjects)))
+
+    paths = []
+    for nr in range(1, subjects + 1):
+        oldlog = nr <= n_old
+        if oldlog:
+            date = old_date + datetime.timedelta(days=(nr - 1) % old_days)
+        else:
+            date = start_date + datetime.timedelta(days=nr - n_old - 1)
+        filename = f"S{nr:0{width}d}_curiosity_v5_{date}_{10 + nr % 8:02d}-00.tsv"
+        path = os.path.join(directory, filename)
+        write_session(path, oldlog=oldlog, seed=rng.integers(2**32), **kwargs)
+        paths.append(path)
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes synthetic Tobii exports of a cohort.")
+    parser.add_argument("directory", help="output directory (e.g. data_to_read_TEST)")
+    parser.add_argument("--subjects", type=int, default=24, help="nr of subjects")
+    parser.add_argument("--old", type=float, default=0.0, help="proportion of old log format sessions")
+    parser.add_argument("--track-loss", type=float, default=0.1, help="proportion of lost samples")
+    parser.add_argument("--offscreen", type=float, default=0.05, help="proportion of off screen fixations")
+    parser.add_argument("--interest", type=float, default=0.6, help="preference for the interesting object")
+    parser.add_argument("--duration", type=float, help="recording length in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    paths = write_cohort(args.directory, subjects=args.subjects, old=args.old, seed=args.seed,
+                         track_loss=args.track_loss, offscreen=args.offscreen, interest=args.interest,
+                         duration=args.duration)
+    print(f"{len(paths)} sessions written to {args.directory}")
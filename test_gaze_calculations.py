@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+collect_gaze (run-length encoded) against the original sample-by-sample loop.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import gaze_calculations as calc
+from constants import ST, AOI_TAGS
+
+
+def collect_gaze_loop(df, threshold=134):
+    """
+    The original collect_gaze loop, kept as the reference.
+    Returns the gaze_list as {rank: [tag, time, duration]}.
+    """
+
+    min_sample_nr = int(threshold / ST)
+
+    gaze_list = [] # list of hit lists
+
+    hits = [] # first element is timestamp of gaze start, rest are look tags.
+    for i in df.index:
+
+        look = df.at[i, "aoi"]
+
+        if look != "OUT":
+
+            if not hits: # empty hits list
+                latency = df.at[i, "TimeStamp"]
+                hits.append(latency)
+                hits.append(look)
+
+            elif look in hits:
+                hits.append(look)
+                # if last row:
+                if (i == df.index[-1]) and (len(hits) > min_sample_nr): # time is also in the hits
+                    gaze_list.append(hits[:])
+
+            else: # new aoi tag
+                if len(hits) >= min_sample_nr:
+                    gaze_list.append(hits[:])
+
+                hits[:] = []
+                latency = df.at[i, "TimeStamp"]
+                hits.append(latency)
+                hits.append(look)
+
+        else:
+            if len(hits) > min_sample_nr:
+                gaze_list.append(hits[:])
+            hits[:] = []
+
+    return {i+1:[gaze[-1], gaze[0], len(gaze[1:])] for i,gaze in enumerate(gaze_list)}
+
+
+def gaze_df(tags, categorical=True, start=1000.0):
+    """ Gaze dataframe of an aoi tag sequence, with a non-default index as a window of a session. """
+
+    aoi = pd.Categorical(tags, categories=AOI_TAGS) if categorical else pd.Series(tags, dtype=object).to_numpy()
+    index = np.arange(len(tags)) + 500
+
+    return pd.DataFrame({"TimeStamp": start + np.arange(len(tags)) * ST, "aoi": aoi}, index=index)
+
+
+def runs(*runs):
+    """ Tag sequence of (tag, nr of samples) runs. """
+
+    return [tag for tag, length in runs for _ in range(length)]
+
+
+def check_against_loop(tags, threshold=134, categorical=True):
+
+    df = gaze_df(tags, categorical=categorical)
+    expected = collect_gaze_loop(df, threshold=threshold)
+    gaze_coll = calc.collect_gaze(df, threshold=threshold)
+
+    assert gaze_coll.get_taglist() == [str(tag) for tag, _, _ in expected.values()]
+    # tag, starting time and duration of every rank
+    np.testing.assert_array_equal(gaze_coll._gazes, calc.GazeCollection(expected)._gazes)
+
+
+# 8 samples at the default threshold: a run followed by another object needs 7, followed by OUT 8,
+# at the last row 8
+N = int(134 / ST)
+
+
+@pytest.mark.parametrize("length", [N-2, N-1, N, N+1])
+@pytest.mark.parametrize("categorical", [True, False])
+def test_run_followed_by_new_tag(length, categorical):
+
+    tags = runs(("INT", length), ("BOR", N+3), ("OUT", 2))
+    check_against_loop(tags, categorical=categorical)
+
+    gazes = calc.collect_gaze(gaze_df(tags, categorical=categorical)).get_taglist()
+    assert gazes == (["INT", "BOR"] if length >= N-1 else ["BOR"])
+
+
+@pytest.mark.parametrize("length", [N-2, N-1, N, N+1])
+@pytest.mark.parametrize("categorical", [True, False])
+def test_run_followed_by_out(length, categorical):
+
+    tags = runs(("OUT", 3), ("FAM", length), ("OUT", 3))
+    check_against_loop(tags, categorical=categorical)
+
+    gazes = calc.collect_gaze(gaze_df(tags, categorical=categorical)).get_taglist()
+    assert gazes == (["FAM"] if length >= N else [])
+
+
+@pytest.mark.parametrize("length", [1, 2, N-2, N-1, N, N+1])
+@pytest.mark.parametrize("categorical", [True, False])
+def test_run_at_last_row(length, categorical):
+
+    tags = runs(("INT", N+2), ("BOR", length))
+    check_against_loop(tags, categorical=categorical)
+
+    gazes = calc.collect_gaze(gaze_df(tags, categorical=categorical)).get_taglist()
+    assert gazes == (["INT", "BOR"] if length >= N else ["INT"])
+
+
+@pytest.mark.parametrize("threshold", [0, 17, 34, 50, 134, 300])
+@pytest.mark.parametrize("length", [1, 2, 3])
+def test_short_runs_at_small_thresholds(threshold, length):
+
+    for tags in (runs(("ATT", length)), runs(("ATT", length), ("OUT", 1)), runs(("ATT", length), ("INT", length)),
+                 runs(("OUT", 1), ("ATT", length), ("INT", 1))):
+        check_against_loop(tags, threshold=threshold)
+
+
+@pytest.mark.parametrize("tags", [[], ["OUT"], ["INT"], runs(("OUT", 20))])
+def test_empty_and_single_samples(tags):
+
+    check_against_loop(tags)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("threshold", [34, 134, 200])
+def test_random_tag_sequences(seed, threshold):
+
+    rng = np.random.default_rng(seed)
+    # runs of random tags and lengths around the thresholds
+    run_tags = rng.choice(AOI_TAGS, size=60, p=[0.3, 0.2, 0.2, 0.1, 0.2]).tolist()
+    run_lengths = rng.integers(1, 2 * int(threshold / ST) + 3, size=60)
+    tags = [tag for tag, length in zip(run_tags, run_lengths) for _ in range(length)]
+
+    check_against_loop(tags, threshold=threshold, categorical=bool(seed % 2))
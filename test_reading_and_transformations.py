@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+The AOI lookup tables (reading_and_transformations._aoi_lookup_tables) against the rectangle logic
+of the original assign_aoi_tags (contains: borders included, priority INT > BOR > ATT > FAM > OUT),
+the chunked reader against read_tsv_file, and interpolate_missing_samples against the original loop.
+"""
+
+import collections
+import numpy as np
+import pandas as pd
+import pytest
+
+import constants as c
+import reading_and_transformations as rt
+
+
+AOI = collections.namedtuple("AOI", "inter, bor, fam1, fam2")
+
+# teaching: interesting and boring object left or right; test: the 4 sides, with and without the attention getter
+TEACHING_LAYOUTS = [(AOI(inter=c.AOI_left, bor=c.AOI_right, fam1=None, fam2=None), None),
+                    (AOI(inter=c.AOI_right, bor=c.AOI_left, fam1=None, fam2=None), None)]
+TEST_LAYOUTS = [(AOI(*c.AOI_dict[side]), aoi_ag) for side in c.AOI_dict for aoi_ag in (None, c.AOI_ag)]
+LAYOUTS = TEACHING_LAYOUTS + TEST_LAYOUTS
+
+# borders off the integer grid: no lookup tables, tagged with the broadcasted rectangle tests
+FALLBACK_LAYOUT = (AOI(inter=[(480.25, 600), 640, 640], bor=[(1440, 600.5), 640, 640], fam1=None, fam2=None),
+                   [(960, 600), 320.3, 320])
+
+
+def contains(gpx, gpy, AOI):
+    """ Checks if a pair of coordinates is within an AOI (the original per-sample test). """
+
+    aoix, aoiy = AOI[0][0], AOI[0][1]
+    width, height = AOI[1], AOI[2]
+
+    return (aoix - width/2) <= gpx <= (aoix + width/2) and (aoiy - height/2) <= gpy <= (aoiy + height/2)
+
+
+def gazepoint_to_aoi(gpx, gpy, valid, aoi, aoi_ag=None):
+
+    if not valid:
+        return "OUT"
+    if contains(gpx, gpy, aoi.inter):
+        return "INT"
+    elif contains(gpx, gpy, aoi.bor):
+        return "BOR"
+    elif aoi_ag and contains(gpx, gpy, aoi_ag):
+        return "ATT"
+    elif aoi.fam1 and contains(gpx, gpy, aoi.fam1):
+        return "FAM"
+    elif aoi.fam2 and contains(gpx, gpy, aoi.fam2):
+        return "FAM"
+    else:
+        return "OUT"
+
+
+def border_points(aoi, aoi_ag):
+    """ Gaze coordinates on, next to and around every AOI border, along both axes. """
+
+    aois = [AOI for AOI in (*aoi, aoi_ag) if AOI]
+    xs = [AOI[0][0] + s * AOI[1]/2 for AOI in aois for s in (-1, 1)] + [AOI[0][0] for AOI in aois]
+    ys = [AOI[0][1] + s * AOI[2]/2 for AOI in aois for s in (-1, 1)] + [AOI[0][1] for AOI in aois]
+
+    def around(values, screen):
+        values = np.array(values + [0, screen, -1, screen + 1], dtype=np.float64)
+        values = np.concatenate([values, values - 0.5, values + 0.5,
+                                 np.nextafter(values, -np.inf), np.nextafter(values, np.inf),
+                                 np.nextafter(values.astype(np.float32), np.float32(-np.inf)).astype(np.float64),
+                                 np.nextafter(values.astype(np.float32), np.float32(np.inf)).astype(np.float64)])
+        return np.unique(values)
+
+    x, y = np.meshgrid(around(xs, c.X), around(ys, c.Y))
+    return x.ravel(), y.ravel()
+
+
+def random_points(n=20000, seed=0):
+    """ Random gaze coordinates on and around the screen, rounded to float32 as read_tsv_file stores them. """
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-50, c.X + 50, n).astype(np.float32)
+    y = rng.uniform(-50, c.Y + 50, n).astype(np.float32)
+    # a quarter of them on integer coordinates, as in the exports
+    x[::4], y[::4] = np.round(x[::4]), np.round(y[::4])
+
+    return x.astype(np.float64), y.astype(np.float64)
+
+
+def check_against_contains(aoi, aoi_ag, x, y, valid):
+
+    codes = rt.aoi_tag_codes(x, y, valid, aoi, aoi_ag=aoi_ag)
+    expected = [gazepoint_to_aoi(gpx, gpy, v, aoi, aoi_ag) for gpx, gpy, v in zip(x, y, valid)]
+
+    assert [c.AOI_TAGS[code] for code in codes] == expected
+
+
+@pytest.mark.parametrize("aoi, aoi_ag", LAYOUTS)
+def test_layouts_have_lookup_tables(aoi, aoi_ag):
+
+    assert rt._aoi_lookup_tables(rt.aoi_layout(aoi, aoi_ag)) is not None
+
+
+def test_fallback_layout_has_no_lookup_tables():
+
+    assert rt._aoi_lookup_tables(rt.aoi_layout(*FALLBACK_LAYOUT)) is None
+
+
+@pytest.mark.parametrize("aoi, aoi_ag", LAYOUTS + [FALLBACK_LAYOUT])
+def test_border_points_agree_with_contains(aoi, aoi_ag):
+
+    x, y = border_points(aoi, aoi_ag)
+    check_against_contains(aoi, aoi_ag, x, y, np.ones(len(x), dtype=bool))
+
+
+@pytest.mark.parametrize("aoi, aoi_ag", LAYOUTS + [FALLBACK_LAYOUT])
+def test_random_points_agree_with_contains(aoi, aoi_ag):
+
+    x, y = random_points()
+    valid = np.random.default_rng(1).random(len(x)) > 0.1
+    check_against_contains(aoi, aoi_ag, x, y, valid)
+
+
+def test_invalid_and_missing_points_are_out():
+
+    aoi, aoi_ag = TEST_LAYOUTS[1]
+    x = np.array([480, 960, -1, np.nan, 480, np.inf])
+    y = np.array([300, 600, -1, 300, np.nan, 600])
+    valid = np.array([False, False, False, True, True, True])
+
+    codes = rt.aoi_tag_codes(x, y, valid, aoi, aoi_ag=aoi_ag)
+
+    assert (codes == c.AOI_TAGS.index("OUT")).all()
+
+
+def write_export(path, n_rows=401, event_rows=(0, 1, 5, 150), integer_gaze=True, integer_timestamps=False, seed=0):
+    """ Writes a small Tobii-like export; the gaze cells of the event rows are empty. """
+
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(n_rows) * 17 if integer_timestamps else np.round(np.arange(n_rows) * c.ST, 1)
+    x, y = rng.integers(0, c.X, n_rows), rng.integers(0, c.Y, n_rows)
+    lost = rng.random(n_rows) < 0.2
+    x[lost], y[lost] = -1, -1
+
+    with open(path, "w") as f:
+        f.write("TimeStamp\tEvent\tGazePointX\tGazePointY\tPupilLeft\n")
+        for i in range(n_rows):
+            if i in event_rows:
+                f.write(f"{timestamps[i]}\tintro_with_face_start\t\t\t\n")
+            elif integer_gaze:
+                f.write(f"{timestamps[i]}\t\t{x[i]}\t{y[i]}\t3.5\n")
+            else:
+                f.write(f"{timestamps[i]}\t\t{x[i] + 0.5}\t{y[i] + 0.5}\t3.5\n")
+
+
+@pytest.mark.parametrize("integer_gaze", [True, False])
+@pytest.mark.parametrize("chunksize", [100, 1000])
+def test_chunked_reader_is_detach_events_of_read_tsv_file(tmp_path, integer_gaze, chunksize):
+
+    # with chunksize 100 the chunks after the second have no event rows
+    path = str(tmp_path / "export.tsv")
+    write_export(path, integer_gaze=integer_gaze)
+
+    df_events, df = rt.detach_events(rt.read_tsv_file(path))
+    chunked_events, chunked = rt.read_tsv_file_chunked(path, chunksize=chunksize)
+
+    pd.testing.assert_frame_equal(chunked_events, df_events, check_index_type=False)
+    pd.testing.assert_frame_equal(chunked, df, check_index_type=False)
+
+
+def test_chunked_reader_rejects_what_read_tsv_file_rejects(tmp_path):
+
+    path = str(tmp_path / "export.tsv")
+    write_export(path, integer_timestamps=True)
+
+    assert rt.read_tsv_file(path) is None
+    assert rt.read_tsv_file_chunked(path, chunksize=100) == (None, None)
+
+
+def interpolate_missing_samples_loop(df, freq=60, max_gap_length=101):
+    """ The original interpolation loop on the legacy 'gazepoints' column, kept as the reference. """
+
+    # set new indexes to iterate over while keeping original as a column
+    df = df.assign(original_index=df.index, new_index=range(len(df.index)))
+    df.set_index("new_index", inplace=True)
+
+    s_gp = df["gazepoints"].copy()
+
+    sample_time = 1000/freq
+    max_sample_nr = int(max_gap_length / sample_time) # 6
+
+    startindex = s_gp.index[2]
+    lastindex = s_gp.index[-3]
+
+    i = startindex
+    while i <= lastindex:
+
+        if s_gp[i] == "invalid":
+
+            counter = 1
+            j = i+1
+            start = i
+            while (j <= lastindex) and (s_gp[j] ==  "invalid"):
+                counter += 1
+                j = j+1
+
+            if counter <= max_sample_nr:
+
+                # chech for 2-2 valid samples on both ends
+                indices_to_check = [start-2, start-1, j, j+1]
+                checked_samples = [s_gp[ind] for ind in indices_to_check]
+                if "invalid" not in checked_samples:
+
+                    prec_sample = s_gp[start-1]
+                    foll_sample = s_gp[j]
+                    fill_values = _calculate_fill_values(prec_sample, foll_sample, counter)
+                    for ind, value in zip(range(start, j), fill_values):
+                        s_gp[ind] = value
+
+            i = j+1
+
+        else:
+            i = i+1
+
+    df = df.assign(gazepoints = s_gp)
+    return df
+
+
+def _calculate_fill_values(prec_sample, foll_sample, counter):
+
+    x1 = prec_sample[0]
+    y1 = prec_sample[1]
+    x2 = foll_sample[0]
+    y2 = foll_sample[1]
+    x_step = (x2-x1)/(counter+1)
+    y_step = (y2-y1)/(counter+1)
+    fill_x = [x1+c*x_step for c in range(1,counter+1)]
+    fill_y = [y1+c*y_step for c in range(1,counter+1)]
+
+    return list((zip(fill_x, fill_y)))
+
+
+def gaze_session(n, track_loss, seed):
+    """ Gaze dataframe as read_tsv_file + detach_events returns it: float32 x, y, track loss in bursts. """
+
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(0, c.X, n).astype(np.float32)
+    y = rng.uniform(0, c.Y, n).astype(np.float32)
+
+    # gaps of 1-10 samples, some at the ends of the data
+    valid = np.ones(n, dtype=bool)
+    for start in rng.integers(0, n, int(n * track_loss / 5) + 1):
+        valid[start:start + rng.integers(1, 11)] = False
+    x[~valid], y[~valid] = -1, -1
+
+    index = np.sort(rng.choice(np.arange(3 * n), n, replace=False)) # detached events: gaps in the index
+    return pd.DataFrame({"TimeStamp": np.arange(n) * c.ST, "x": x, "y": y, "valid": valid}, index=index)
+
+
+@pytest.mark.parametrize("seed", range(30))
+@pytest.mark.parametrize("n, track_loss", [(6, 0.5), (40, 0.3), (500, 0.2), (500, 0.6)])
+def test_interpolation_matches_the_loop(seed, n, track_loss):
+
+    df = gaze_session(n, track_loss, seed)
+
+    expected = interpolate_missing_samples_loop(rt.add_gazepoints_column(df))
+    result = rt.interpolate_missing_samples(df)
+
+    np.testing.assert_array_equal(result["original_index"], expected["original_index"])
+    np.testing.assert_array_equal(result["valid"], (expected["gazepoints"] != "invalid").to_numpy())
+
+    # the interpolated values of the loop (float64), stored as float32 as the x, y columns
+    filled = result["valid"].to_numpy()
+    expected_xy = np.array([gp for gp in expected["gazepoints"][filled]], dtype=np.float64).reshape(-1, 2)
+    np.testing.assert_array_equal(result["x"][filled], expected_xy[:, 0].astype(np.float32))
+    np.testing.assert_array_equal(result["y"][filled], expected_xy[:, 1].astype(np.float32))
+    np.testing.assert_array_equal(result["x"][~filled], -1)
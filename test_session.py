@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+The windows of Session against the original boolean masks of the phases:
+teaching, baseline and attention getter start < TimeStamp < end, test start <= TimeStamp <= end,
+on screen proportions start <= TimeStamp < end; and unsorted sessions reported as compromised.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+import constants as c
+import main_data_parser as mdp
+import synthetic_sessions
+from session import Session
+
+
+def gaze_session(n=300, seed=0):
+    """ Gaze dataframe with the float timestamps of the exports, the index with gaps of detached events. """
+
+    rng = np.random.default_rng(seed)
+    index = np.sort(rng.choice(np.arange(2 * n), n, replace=False))
+
+    return pd.DataFrame({"TimeStamp": np.round(np.arange(n) * c.ST, 1),
+                         "x": rng.uniform(0, c.X, n).astype(np.float32),
+                         "y": rng.uniform(0, c.Y, n).astype(np.float32),
+                         "valid": rng.random(n) > 0.3}, index=index)
+
+
+def boundaries(df):
+    """ Window ends on sample times, between samples and outside the session. """
+
+    t = df["TimeStamp"].to_numpy()
+    return [t[0] - 100, t[0], t[0] + 5, t[10], t[10] + 5, t[57], t[-1] - 5, t[-1], t[-1] + 100]
+
+
+def windows(df):
+    bounds = boundaries(df)
+    return [(start, end) for start in bounds for end in bounds]
+
+
+@pytest.mark.parametrize("include_start, include_end, mask", [
+    (False, False, lambda t, start, end: (t > start) & (t < end)), # teaching, baseline, attention getter
+    (True, True, lambda t, start, end: (t >= start) & (t <= end)), # test
+    (True, False, lambda t, start, end: (t >= start) & (t < end))])
+def test_window_is_the_mask(include_start, include_end, mask):
+
+    df = gaze_session()
+    session = Session(df)
+
+    for start, end in windows(df):
+        window = session.window(start, end, include_start=include_start, include_end=include_end)
+        pd.testing.assert_frame_equal(window, df[mask(df["TimeStamp"], start, end)])
+
+
+def test_tagged_window_has_the_rows_of_the_mask():
+
+    df = gaze_session()
+    session = Session(df)
+    aoi = mdp.AOI(*c.AOI_dict["top-left"])
+
+    for start, end in windows(df):
+        window = session.window(start, end, aoi=aoi)
+        expected = df[(df["TimeStamp"] > start) & (df["TimeStamp"] < end)]
+        np.testing.assert_array_equal(window.index, expected.index)
+        np.testing.assert_array_equal(window["TimeStamp"], expected["TimeStamp"])
+
+
+def test_onscreen_look_is_the_mask():
+
+    df = gaze_session()
+    start_times, end_times = zip(*windows(df))
+
+    expected = []
+    for start, end in zip(start_times, end_times):
+        valid = df["valid"][(df["TimeStamp"] >= start) & (df["TimeStamp"] < end)]
+        expected.append(valid.sum() / valid.size if valid.size else np.nan)
+
+    np.testing.assert_array_equal(mdp._calculate_onscreen_look(Session(df), start_times, end_times), expected)
+
+
+@pytest.mark.parametrize("timestamp", [np.nan, 100.0])
+def test_unsorted_session_raises(timestamp):
+
+    df = gaze_session()
+    df.iloc[50, df.columns.get_loc("TimeStamp")] = timestamp
+
+    with pytest.raises(ValueError):
+        Session(df)
+
+
+def test_unsorted_logfile_is_compromised(tmp_path):
+
+    df = synthetic_sessions.generate_session(seed=1)
+    timestamps = df["TimeStamp"].to_numpy().copy()
+    timestamps[[1000, 1001]] = timestamps[[1001, 1000]]
+    df["TimeStamp"] = timestamps
+
+    log = "S001_curiosity_v5_2020-03-02_10-00.tsv"
+    df.to_csv(os.path.join(tmp_path, log), sep="\t", index=False)
+    config = mdp.RunConfig(base_dir=str(tmp_path), logfilespath=str(tmp_path), use_cache=False)
+
+    assert mdp.process_logfile(log, config)["status"] == "compromised"
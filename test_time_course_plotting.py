@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Paired Familiar/Novel differences and the cluster tests of the time course.
+"""
+
+import os
+import numpy as np
+
+import time_course_plotting as time_course
+
+
+def test_paired_differences_match_subjects():
+
+    familiar = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]], dtype=np.float32)
+    novel = np.array([[10, 20], [30, 40]], dtype=np.float32)
+
+    differences = time_course._paired_differences(familiar, novel, ["S1", "S2", "S3"], ["S3", "S1"])
+
+    # rows in the order of the familiar subjects with a novel trial, samples of the longer trial
+    np.testing.assert_array_equal(differences, [[29, 38, np.nan], [3, 12, np.nan]])
+
+
+def test_paired_differences_without_common_subjects():
+
+    familiar, novel = np.ones((2, 3), dtype=np.float32), np.ones((1, 4), dtype=np.float32)
+
+    assert time_course._paired_differences(familiar, novel, ["S1", "S2"], ["S3"]).shape == (0, 4)
+
+
+def test_cluster_tests_of_one_subject_are_skipped(tmp_path):
+
+    matrices = {0: np.zeros((1, 5), dtype=np.float32), 1: np.ones((1, 5), dtype=np.float32)}
+    subjects = {0: ["S1"], 1: ["S1"]}
+
+    time_course._do_cluster_tests(matrices, subjects, fam=False, tables_dir=str(tmp_path), n_permutations=100,
+                                  workers=1)
+
+    assert os.listdir(tmp_path) == []
@@ -21,34 +21,29 @@ We need another key:value in the input dicts: responded:yes/no
 from __future__ import print_function
 from __future__ import division
 import pandas as pd
-pd.options.mode.chained_assignment = None
 import numpy as np
 import os
 import datetime
 import pickle
-import swifter
 
-from constants import DIR, ST
-import plot_plotly as plot
+from constants import DIR, ST, AOI_TAGS
+from time_course_store import TimeCourseStore, open_run
+from cluster_permutation import N_PERMUTATIONS
+# plot_plotly (plotly) is imported in the function using it, as it is slow to import
 
 
-date = str(datetime.datetime.today().date())
+def open_time_course(date=None, timing=None):
+    """ Analyses the time course of a saved run (default: the latest run, of any timing), see time_course_store. """
 
-#input
-pickle_jar = os.path.join(DIR, "time_course", "pickle")
+    analyse_time_course(open_run(date=date, timing=timing))
 
-#output
-plots_dir = os.path.join(DIR, "time_course", "plots", f"{date}")
-tables_dir_name = os.path.join(DIR, "time_course", "tables", f"{date}")
-excelfile = os.path.join(tables_dir_name, f"target_look_dataframes_per_label_{date}.xlsx")
-writer = pd.ExcelWriter(excelfile)
 
-
-def open_pickle():
+# time course dicts pickled before the time course store
+def open_pickle(pickle_filename="tc_dict_4sec_test_2020-07-23"):
 
     tc_dict = {}
 
-    pickle_filename = "tc_dict_4sec_test_2020-07-23"
+    pickle_jar = os.path.join(DIR, "time_course", "pickle")
 
     with open(os.path.join(pickle_jar, pickle_filename + '.pkl'), 'rb') as f:
         tc_dict = pickle.load(f)
@@ -56,9 +51,10 @@ def open_pickle():
     analyse_time_course(tc_dict)
 
 
-def analyse_time_course(tc_dict):
+def analyse_time_course(tc_dict, plots_dir=None, tables_dir=None, n_permutations=N_PERMUTATIONS, n_resamples=0,
+                        workers=1):
     """
-    tc_dict: dictionary with following structure:
+    tc_dict: TimeCourseStore or dictionary with following structure:
         key: subj_nr; value: dict
             key: trial nr (0, 2... for familiar trials and 1,3... for novel trials of subject); value: dict
                 key: "AOI", value: series of aoi tags for trial
@@ -68,60 +64,120 @@ def analyse_time_course(tc_dict):
                 key: "responded", value: boolean
 
     tls_per_trials: dict to collect target looks per trial
-        keys: 0,1 trials; values: list of subject data series for each trial
+        keys: 0,1 trials; values: {subj_nr: data series of the trial}
+
+    plots_dir, tables_dir: output directories, default: time_course/plots/<today>, time_course/tables/<today>
+    n_permutations: permutations of the cluster-based permutation test (cluster_permutation), 0: no test
+    n_resamples: resamples of the bootstrap confidence bands (bootstrap_bands), 0: SE bands
+    workers: nr of processes for the permutations and resamples
     """
 
-    _create_paths([plots_dir, tables_dir_name])
+    date = str(datetime.datetime.today().date())
+    plots_dir = plots_dir or os.path.join(DIR, "time_course", "plots", date)
+    tables_dir = tables_dir or os.path.join(DIR, "time_course", "tables", date)
+
+    _create_paths([plots_dir, tables_dir])
+
+    for fam in [False, True]:
+        _do_target_look_calculations(tc_dict, fam=fam, plots_dir=plots_dir, tables_dir=tables_dir,
+                                     n_permutations=n_permutations, n_resamples=n_resamples, workers=workers)
 
-    _do_target_look_calculations(tc_dict, fam=False)
 
-    _do_target_look_calculations(tc_dict, fam=True)
+def _do_target_look_calculations(tc_dict, fam, plots_dir, tables_dir, n_permutations=0, n_resamples=0, workers=1):
 
+    tls_per_trials = _target_looks_per_trials(tc_dict, fam)
 
-def _do_target_look_calculations(tc_dict, fam):
+    matrices = _prep_data_for_plotting(tls_per_trials, fam, plots_dir, tables_dir, n_resamples, workers)
 
-    tls_per_trials = {nr: [] for nr in [0,1]}
+    if n_permutations:
+        subjects = {nr: list(tls_per_trials[nr]) for nr in tls_per_trials}
+        _do_cluster_tests(matrices, subjects, fam, tables_dir, n_permutations, workers)
 
-    for subj, subj_dict in tc_dict.items(): # subj_dict = tc_dict[subj]
 
-        subj_data = {} # collect subject data
+def _target_looks_per_trials(tc, fam):
+    """
+    Target look series of the responded trials of every subject (see _calculate_target_look),
+    averaged to one familiar and one novel label trial per subject.
+    tc: time course dict or TimeCourseStore
+    returns:
+        tls_per_trials: {0: {subj_nr: series}, 1: {subj_nr: series}}
+    """
 
-        for trial_nr, d in subj_dict.items(): # d = tc_dict[subj][trial_nr]
+    if not isinstance(tc, TimeCourseStore):
+        tc = TimeCourseStore.from_dict(tc)
 
-            trial_nr = int(trial_nr)
+    # baseline of the target in the responded trials
+    trials = np.flatnonzero(tc.responded)
+    trial_nrs = np.asarray(tc.trial_nr)[trials]
 
-            if d["responded"]:
+    if fam:
+        bl_targets = np.asarray(tc.bl_fam)[trials]
+    else:
+        # normalise
+        bl_int, bl_bor = np.asarray(tc.bl_int)[trials], np.asarray(tc.bl_bor)[trials]
+        denom = bl_int + bl_bor
+        if np.any(denom == 0):
+            i = trials[np.argmax(denom == 0)]
+            raise ZeroDivisionError(f"No baseline look on the target and the distractor: "
+                                    f"subject {tc.subjects[tc.subject[i]]}, trial {tc.trial_nr[i]}")
+        bl_targets = np.where(trial_nrs%2==0, bl_int, bl_bor) / denom
 
-                if fam:
-                    target, distractor = "fam", None
-                    bl_target = d["BL_FAM"]
-                else:
-                    target, distractor = ("int", "bor") if trial_nr%2==0 else ("bor", "int")
-                    # normalise
-                    denom = d["BL_INT"] + d["BL_BOR"]
-                    bl_target = d["BL_INT"]/denom if trial_nr%2==0 else d["BL_BOR"]/denom
+    # aoi codes of the responded trials
+    starts = np.asarray(tc.offsets)[trials]
+    lengths = np.asarray(tc.offsets)[trials + 1] - starts
+    samples = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
 
-                test_data_series = pd.Series(d["AOI"])
+    looks = _target_looks(np.asarray(tc.aoi_codes[samples]), lengths, trial_nrs, bl_targets, fam)
 
-                target_look = (test_data_series
-                                    .swifter.progress_bar(False).apply(_calculate_target_look,
-                                           target=target,
-                                           dist=distractor,
-                                           bl_target=bl_target)
-                                )
+    subj_data = {subj: {} for subj in tc.subjects} # collect subject data
+    for i, target_look in zip(trials, looks):
+        subj_data[tc.subjects[tc.subject[i]]][int(tc.trial_nr[i])] = pd.Series(target_look)
 
-                subj_data[trial_nr] = target_look
+    tls_per_trials = {nr: {} for nr in [0,1]}
+    for subj, subj_trials in subj_data.items():
 
         # reduce trials to two by averaging related trials
-        if len(list(subj_data.keys())) > 2:
-            subj_data = _average_paired_trials(subj_data)
+        if len(list(subj_trials.keys())) > 2:
+            subj_trials = _average_paired_trials(subj_trials)
+
+        for n in subj_trials.keys():
+            tls_per_trials[n][subj] = subj_trials[n] # add series
+
+    return tls_per_trials
+
+
+def _target_looks(codes, lengths, trial_nrs, bl_targets, fam):
+    """
+    Vectorized _calculate_target_look for all trials at once.
+    codes: aoi tag codes (AOI_TAGS, -1: unknown) of the trials, one after the other
+    lengths: nr of samples of each trial
+    trial_nrs: trial numbers (even: familiar label trial, target "INT"; odd: novel label trial, target "BOR")
+    bl_targets: baseline of the target in each trial
+    fam: target "FAM", distractors "INT" and "BOR"
+    returns:
+        list of arrays: 1 - bl_target on the target, 0 - (1 - bl_target) on the distractor, nan elsewhere
+    """
+
+    # lookup array per trial: +1 target, -1 distractor, nan for the other tags and the unknown tag (last column)
+    INT, BOR, FAM = AOI_TAGS.index("INT"), AOI_TAGS.index("BOR"), AOI_TAGS.index("FAM")
+    signs = np.full((len(lengths), len(AOI_TAGS) + 1), np.nan)
+    if fam:
+        signs[:, FAM], signs[:, INT], signs[:, BOR] = 1, -1, -1
+    else:
+        familiar_label = np.asarray(trial_nrs) % 2 == 0
+        signs[:, INT] = np.where(familiar_label, 1, -1)
+        signs[:, BOR] = np.where(familiar_label, -1, 1)
+
+    # baseline correction of the target and the distractor (bl_dist = 1 - bl_target)
+    lookup = signs * (1 - np.asarray(bl_targets, dtype=float))[:, None]
 
-        for n in subj_data.keys():
-            tls_per_trials[n].append(subj_data[n]) # append series
+    trial_of_sample = np.repeat(np.arange(len(lengths)), lengths)
+    looks = lookup[trial_of_sample, codes]
 
-    _prep_data_for_plotting(tls_per_trials, fam)
+    return np.split(looks, np.cumsum(lengths)[:-1])
 
 
+# sample by sample version of _target_looks (unused)
 def _calculate_target_look(tag, target, dist, bl_target=0):
     """
     params:
@@ -172,45 +228,154 @@ def _average_paired_trials(subj_trials):
     return {0:mean_fam_data, 1:mean_novel_data}
 
 
-def _prep_data_for_plotting(tls_per_trials, fam):
+def _prep_data_for_plotting(tls_per_trials, fam, plots_dir, tables_dir, n_resamples=0, workers=1):
     """
     for plotly
-    add columns: SE, time, sample mean, nr_of_datapoints
+    add columns: SE, time, sample mean, nr_of_datapoints (and CI_lower, CI_upper if n_resamples)
+    returns:
+        {trial_nr: target look matrix}, rows in the order of the subjects of tls_per_trials[trial_nr]
     """
 
+    import plot_plotly as plot
+
+    matrices = {}
     for trial_nr in tls_per_trials.keys():
 
         nr_of_subjects = len(tls_per_trials[trial_nr])
-        if nr_of_subjects > 1:
-            df_tls = pd.concat(tls_per_trials[trial_nr], axis=1, ignore_index=True)
-        else: # for testing on one file
-            df_tls = pd.DataFrame(columns=["data", "time"])
-            df_tls["data"] = tls_per_trials[trial_nr]
-
-        # add useful columns
-        data_cols = df_tls.columns
-        df_tls = (df_tls
-                .assign(SE = df_tls
-                        .swifter.progress_bar(False).apply(_calculate_standard_error, axis=1))
-                .assign(time = list(df_tls.index * ST))
-                .assign(sample_mean = df_tls.loc[:, data_cols]
-                        .mean(axis=1))
-                .assign(nr_of_datapoints = df_tls.loc[:, data_cols]
-                        .swifter.progress_bar(False).apply(lambda x: x.notna().sum(), axis=1))
-                )
+        matrices[trial_nr] = _target_look_matrix(list(tls_per_trials[trial_nr].values()))
+        df_tls = _time_course_table(matrices[trial_nr])
+
+        if n_resamples:
+            # bootstrap confidence bands instead of SE in the plot
+            import bootstrap_bands
+            df_tls["CI_lower"], df_tls["CI_upper"] = bootstrap_bands.bootstrap_bands(
+                    matrices[trial_nr], n_resamples=n_resamples, workers=workers)
 
         obj = "COMMON objects" if fam else "TARGET object"
         label = "Familiar" if trial_nr==0 else "Novel"
 
-        excelfilename = os.path.join(tables_dir_name, f"Look on {obj}_in_{label}_trials_df.xlsx")
+        excelfilename = os.path.join(tables_dir, f"Look on {obj}_in_{label}_trials_df.xlsx")
 
         df_tls.to_excel(excelfilename, sheet_name=label, index=False)
 
-#        plot.plot_plotly1(df_tls, label=label, obj=obj, n=nr_of_subjects)
+#        plot.plot_plotly1(df_tls, label=label, obj=obj, n=nr_of_subjects, plots_dir=plots_dir)
+
+        plot.plot_plotly2(df_tls, label=label, obj=obj, n=nr_of_subjects, plots_dir=plots_dir)
+
+    return matrices
+
+
+def _do_cluster_tests(matrices, subjects, fam, tables_dir, n_permutations, workers):
+    """
+    Cluster-based permutation tests of the target look: Novel against Familiar label trials
+    (paired: the differences of the subjects with both trials against 0) and each trial type against 0.
+    The clusters are saved in one table.
+    subjects: {trial_nr: subject of each row of matrices[trial_nr]}
+    """
+
+    import cluster_permutation as cluster
+
+    obj = "COMMON objects" if fam else "TARGET object"
+    tests = {"Novel - Familiar (paired)": _paired_differences(matrices[0], matrices[1], subjects[0], subjects[1]),
+             "Familiar vs 0": matrices[0],
+             "Novel vs 0": matrices[1]}
+
+    dfs = []
+    for comparison, matrix in tests.items():
+        if len(matrix) < 2:
+            continue
+        _, clusters = cluster.cluster_test(matrix, n_permutations=n_permutations, workers=workers)
+        clusters.insert(0, "comparison", comparison)
+        dfs.append(clusters)
+
+    if not dfs:
+        print(f"Look on {obj}: not enough subjects for the cluster tests")
+        return
+
+    df_clusters = pd.concat(dfs, ignore_index=True)
+    df_clusters["start_time"] = df_clusters["start"] * ST
+    df_clusters["end_time"] = df_clusters["end"] * ST
+
+    excelfilename = os.path.join(tables_dir, f"Clusters of look on {obj}.xlsx")
+    df_clusters.to_excel(excelfilename, sheet_name="clusters", index=False)
+
+    significant = df_clusters[df_clusters["p_value"] < 0.05]
+    print(f"Look on {obj}: {len(significant)} significant clusters of {len(df_clusters)} ({n_permutations} permutations)")
+
+
+def _paired_differences(familiar, novel, familiar_subjects, novel_subjects):
+    """
+    Novel minus Familiar target look of the subjects with both trials.
+    familiar, novel: target look matrices, rows: familiar_subjects, novel_subjects
+    returns:
+        subjects x samples array (nan where either trial has no data), samples of the longer matrix
+    """
+
+    rows_of_novel = {subj: row for row, subj in enumerate(novel_subjects)}
+    familiar_rows = np.array([row for row, subj in enumerate(familiar_subjects) if subj in rows_of_novel], dtype=np.intp)
+    novel_rows = np.array([rows_of_novel[familiar_subjects[row]] for row in familiar_rows], dtype=np.intp)
+
+    nr_of_samples = max(familiar.shape[1], novel.shape[1])
+    differences = np.full((len(familiar_rows), nr_of_samples), np.nan, dtype=np.float64)
+    differences[:, :novel.shape[1]] = novel[novel_rows]
+    differences[:, :familiar.shape[1]] -= familiar[familiar_rows]
+    differences[:, familiar.shape[1]:] = np.nan
+
+    return differences
+
+
+def _target_look_matrix(target_looks, dtype=np.float32):
+    """
+    target_looks: list of the target look series (or arrays) of the subjects, starting at the same sample
+    returns:
+        subjects x samples array, nan-padded to the longest series
+    """
+
+    lengths = np.array([len(tl) for tl in target_looks], dtype=np.int64)
+    matrix = np.full((len(lengths), lengths.max(initial=0)), np.nan, dtype=dtype)
+    if lengths.sum():
+        rows = np.repeat(np.arange(len(lengths)), lengths)
+        cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        matrix[rows, cols] = np.concatenate([np.asarray(tl, dtype=dtype) for tl in target_looks])
+
+    return matrix
+
+
+def _time_course_stats(matrix):
+    """
+    Statistics of the subjects at each sample (column) of the target look matrix, nan values are skipped.
+    returns:
+        sample_mean
+        SE: sd (ddof=1) / sqrt of the nr of subjects (all subjects, as in _calculate_standard_error)
+        nr_of_datapoints: nr of subjects with data at the sample
+    """
+
+    counts = np.sum(~np.isnan(matrix), axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nansum(matrix, axis=0, dtype=np.float64) / counts
+        var = np.nansum((matrix - mean) ** 2, axis=0, dtype=np.float64) / (counts - 1)
+    var[counts < 2] = np.nan
+    se = np.sqrt(var) / np.sqrt(matrix.shape[0])
+
+    return mean, se, counts
+
+
+def _time_course_table(matrix):
+    """
+    Table of the time course: a column of target looks for each subject, then
+    SE, time (ms), sample_mean and nr_of_datapoints of each sample.
+    """
+
+    mean, se, counts = _time_course_stats(matrix)
+
+    df_tls = pd.DataFrame(matrix.T)
+    df_tls = df_tls.assign(SE=se, time=np.arange(matrix.shape[1]) * ST, sample_mean=mean, nr_of_datapoints=counts)
 
-        plot.plot_plotly2(df_tls, label=label, obj=obj, n=nr_of_subjects)
+    return df_tls
 
 
+# SE of one sample, as in _time_course_stats (unused)
 def _calculate_standard_error(sample):
     """
     a sample: series of data of all subjects at the timepoint
@@ -250,7 +415,7 @@ def _create_paths(paths):
 
 
 if __name__ == "__main__":
-    open_pickle()
+    open_time_course()
 
 
 
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar on-disk store of the time course data of a run (replaces the pickled time_course_dict).
+
+A run is a directory time_course/store/tc_<timing>_<date> of .npy files, memory-mapped on load:
+    aoi_codes: int8 aoi tag codes (constants.AOI_TAGS, -1: unknown) of all trials, one after the other
+    offsets: start of each trial in aoi_codes (nr of trials + 1)
+    subject, trial_nr: subject (index in subjects) and trial nr of each trial
+    bl_int, bl_bor, bl_fam, responded: baseline looks and response of each trial
+and meta.json with the subject numbers and the aoi tags.
+"""
+
+import datetime
+import itertools
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from constants import DIR, AOI_TAGS
+
+
+STORE_VERSION = 1
+ARRAYS = ("aoi_codes", "offsets", "subject", "trial_nr", "bl_int", "bl_bor", "bl_fam", "responded")
+
+
+class TimeCourseStore:
+
+    def __init__(self, subjects, aoi_codes, offsets, subject, trial_nr, bl_int, bl_bor, bl_fam, responded):
+        """
+        subjects: subject numbers
+        the arrays: see the module docstring
+        """
+        self.subjects = list(subjects)
+        self.aoi_codes = aoi_codes
+        self.offsets = offsets
+        self.subject = subject
+        self.trial_nr = trial_nr
+        self.bl_int = bl_int
+        self.bl_bor = bl_bor
+        self.bl_fam = bl_fam
+        self.responded = responded
+
+
+    @classmethod
+    def from_dict(cls, tc_dict):
+        """ tc_dict: {subj_nr: {trial_nr: {"AOI", "BL_INT", "BL_BOR", "BL_FAM", "responded"}}} (see parse_test_data) """
+
+        subjects = list(tc_dict)
+        trials = [(s, int(trial_nr), d) for s, subj_nr in enumerate(subjects)
+                  for trial_nr, d in tc_dict[subj_nr].items()]
+
+        lengths = [len(d["AOI"]) for _, _, d in trials]
+        tags = itertools.chain.from_iterable(d["AOI"] for _, _, d in trials)
+
+        return cls(subjects,
+                   aoi_codes=pd.Categorical(list(tags), categories=AOI_TAGS).codes.astype(np.int8),
+                   offsets=np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))),
+                   subject=np.array([s for s, _, _ in trials], dtype=np.int32),
+                   trial_nr=np.array([n for _, n, _ in trials], dtype=np.int16),
+                   bl_int=np.array([d["BL_INT"] for _, _, d in trials], dtype=np.float64),
+                   bl_bor=np.array([d["BL_BOR"] for _, _, d in trials], dtype=np.float64),
+                   bl_fam=np.array([d["BL_FAM"] for _, _, d in trials], dtype=np.float64),
+                   responded=np.array([d["responded"] for _, _, d in trials], dtype=bool))
+
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """ Opens a saved run; the arrays are memory-mapped (read only) if mmap. """
+
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != STORE_VERSION or meta.get("aoi_tags") != AOI_TAGS:
+            raise ValueError(f"{path} is not a time course store of this version")
+
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None)
+                  for name in ARRAYS}
+
+        return cls(meta["subjects"], **arrays)
+
+
+    def save(self, path):
+        """ Writes the store to the directory path (replaced if it exists). """
+
+        tmp = path + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(dict(version=STORE_VERSION, aoi_tags=AOI_TAGS, subjects=self.subjects), f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+
+    def __len__(self):
+        return len(self.trial_nr)
+
+
+    def trial_codes(self, i):
+        """ aoi tag codes of trial i """
+        return self.aoi_codes[self.offsets[i]:self.offsets[i+1]]
+
+
+    def to_dict(self):
+        """ The time_course_dict of the run. """
+
+        tags = np.array(AOI_TAGS + [None], dtype=object) # code -1: None
+
+        tc_dict = {subj_nr: {} for subj_nr in self.subjects}
+        for i in range(len(self)):
+            tc_dict[self.subjects[self.subject[i]]][int(self.trial_nr[i])] = dict(
+                responded=bool(self.responded[i]),
+                BL_INT=float(self.bl_int[i]),
+                BL_BOR=float(self.bl_bor[i]),
+                BL_FAM=float(self.bl_fam[i]),
+                AOI=tags[self.trial_codes(i)].tolist())
+
+        return tc_dict
+
+
+def run_path(timing, date, base_dir=DIR):
+    """ Directory of the time course store of a run. """
+    return os.path.join(_store_dir(base_dir), f"tc_{timing}_{date}")
+
+
+def open_run(date=None, timing=None, base_dir=DIR, mmap=True):
+    """
+    Opens the time course store of the run of date ("YYYY-MM-DD", default: the latest run) and timing
+    ("2sec_test" or "4sec_test", default: the timing of the latest run).
+    """
+
+    if date is None or timing is None:
+        runs = _saved_runs(base_dir, timing)
+        if date is not None:
+            runs = [run for run in runs if run[1] == str(date)]
+        if not runs:
+            run = " ".join(str(part) for part in (timing, date) if part)
+            raise FileNotFoundError(f"no time course store{' of ' + run if run else ''} in {_store_dir(base_dir)}")
+        timing, date = runs[-1]
+    elif isinstance(date, datetime.date):
+        date = str(date)
+
+    return TimeCourseStore.load(run_path(timing, date, base_dir), mmap=mmap)
+
+
+def _store_dir(base_dir):
+    return os.path.join(base_dir, "time_course", "store")
+
+
+def _saved_runs(base_dir, timing=None):
+    """ (timing, date) of the saved runs (of timing), oldest first (runs of the same date by modification time). """
+
+    store_dir = _store_dir(base_dir)
+    if not os.path.isdir(store_dir):
+        return []
+
+    runs = []
+    for name in os.listdir(store_dir):
+        if not name.startswith("tc_") or name.endswith(".tmp"):
+            continue
+        run_timing, _, date = name[len("tc_"):].rpartition("_")
+        if timing is None or run_timing == timing:
+            runs.append((date, os.path.getmtime(os.path.join(store_dir, name)), run_timing))
+
+    return [(run_timing, date) for date, _, run_timing in sorted(runs)]